@@ -0,0 +1,370 @@
+import struct
+import sys
+import zlib
+from array import array
+
+import utils
+from ir import *
+
+
+class ASTFile:
+    """
+    Versioned binary format for parsed programs: the statements and the
+    variable table.
+
+    Nodes are stored in post-order as one tag byte each, with their integer
+    arguments (child node indices, variable indices, int values and type
+    codes) and float values in two separate columns. Shared nodes, such as
+    interned leaves and hash-consed subtrees, are stored once. The body is
+    zlib-compressed.
+    """
+
+    class Error(Exception):
+        pass
+
+    MAGIC = b'CPLAST'
+    VERSION = 2
+
+    # Tags of nodes that are not operators
+    LIST = 0
+    USE = 1
+    INT = 2
+    BIG_INT = 3
+    FLOAT = 4
+    STATIC_CAST = 5
+    CONDITIONAL = 6
+    WHILE = 7
+    SWITCH = 8
+    BREAK = 9
+    INPUT = 10
+    OUTPUT = 11
+
+    # Operators are tagged by OPERATOR_TAG_BASE plus their index in OPERATORS.
+    # Only ever append to these lists, or bump VERSION.
+    OPERATOR_TAG_BASE = 32
+    OPERATORS = [UnaryAdd, Negate, Not, Assign, Add, Sub, Mul, Div, Or, And,
+                 Equal, NotEqual, Less, Greater, LessOrEqual, GreaterOrEqual]
+    TYPES = [Integer, Float]
+
+    OPERATOR_TAGS = dict(zip(OPERATORS, range(OPERATOR_TAG_BASE, OPERATOR_TAG_BASE + len(OPERATORS))))
+    TYPE_CODES = dict(zip(TYPES, range(len(TYPES))))
+
+    # Lengths of the strings blob and numbers of strings, variables, tags,
+    # int arguments and float values
+    COUNTS = struct.Struct('<6Q')
+
+    INT_MIN = -(1 << 63)
+    INT_MAX = (1 << 63) - 1
+
+    @classmethod
+    def save(cls, output_file, stmts, variables):
+        """
+        Writes a program to a binary file.
+        """
+        with utils.gc_paused():
+            data = cls._save_body(stmts, variables)
+        output_file.write(cls.MAGIC + struct.pack('<H', cls.VERSION) + data)
+
+    @classmethod
+    def _save_body(cls, stmts, variables):
+        strings = []
+        type_codes = bytearray()
+        variable_indices = {}
+        for variable in variables.values():
+            variable_indices[id(variable)] = len(strings)
+            strings.append(variable.name)
+            type_codes.append(cls.TYPE_CODES[variable.type_class])
+
+        tags = bytearray()
+        args = array('q')
+        floats = array('d')
+        # Index 0 stands for a missing node (None)
+        indices = {}
+
+        def index_of(node):
+            return 0 if node is None else indices[id(node)]
+
+        stack = [(stmts, False)]
+        while len(stack) > 0:
+            obj, expanded = stack.pop()
+            if obj is None or id(obj) in indices:
+                continue
+            if not expanded:
+                # Children are written first, so that loading is a single forward pass
+                stack.append((obj, True))
+                stack.extend((child, False) for child in reversed(cls._children(obj)))
+                continue
+
+            obj_type = type(obj)
+            op_tag = cls.OPERATOR_TAGS.get(obj_type)
+            if op_tag is not None:
+                tags.append(op_tag)
+                args.extend(indices[id(op)] for op in obj.operands)
+
+            elif obj_type is Use:
+                variable_index = variable_indices.get(id(obj.variable))
+                if variable_index is None:
+                    raise cls.Error(f'{obj.variable} is missing from the variable table')
+                tags.append(cls.USE)
+                args.append(variable_index)
+
+            elif obj_type is Immediate:
+                value = obj.value
+                if type(value) is float:
+                    tags.append(cls.FLOAT)
+                    floats.append(value)
+                elif cls.INT_MIN <= value <= cls.INT_MAX:
+                    tags.append(cls.INT)
+                    args.append(value)
+                else:
+                    tags.append(cls.BIG_INT)
+                    args.append(len(strings))
+                    strings.append(str(value))
+
+            elif obj_type is list:
+                tags.append(cls.LIST)
+                args.append(len(obj))
+                args.extend(indices[id(stmt)] for stmt in obj)
+
+            elif obj_type is StaticCast:
+                tags.append(cls.STATIC_CAST)
+                args.extend([cls.TYPE_CODES[obj.dest_type], indices[id(obj.operands[0])]])
+
+            elif obj_type is Conditional:
+                tags.append(cls.CONDITIONAL)
+                args.extend([index_of(obj.condition), index_of(obj.true_case), index_of(obj.false_case)])
+
+            elif obj_type is While:
+                tags.append(cls.WHILE)
+                args.extend([index_of(obj.condition), index_of(obj.body)])
+
+            elif obj_type is Switch:
+                tags.append(cls.SWITCH)
+                args.extend([index_of(obj.value), len(obj.cases)])
+                for case in obj.cases:
+                    args.extend([index_of(case.value), index_of(case.stmts)])
+
+            elif obj_type is Break:
+                tags.append(cls.BREAK)
+
+            elif obj_type is Input:
+                tags.append(cls.INPUT)
+                args.append(variable_indices[id(obj.variable)])
+
+            elif obj_type is Output:
+                tags.append(cls.OUTPUT)
+                args.append(index_of(obj.expr))
+
+            else:
+                raise cls.Error(f'Cannot serialize {obj}')
+
+            indices[id(obj)] = len(tags)
+
+        if sys.byteorder != 'little':
+            for column in [args, floats]:
+                column.byteswap()
+
+        strings_blob = '\0'.join(strings).encode()
+        body = b''.join([
+            cls.COUNTS.pack(len(strings_blob), len(strings), len(type_codes), len(tags),
+                            len(args), len(floats)),
+            strings_blob,
+            type_codes,
+            tags,
+            args.tobytes(),
+            floats.tobytes(),
+        ])
+        return zlib.compress(body, 1)
+
+    @classmethod
+    def load(cls, input_file):
+        """
+        Reads a program written by save(). Returns the statements and the
+        variable table.
+        """
+        header = input_file.read(len(cls.MAGIC) + 2)
+        if not header.startswith(cls.MAGIC) or len(header) != len(cls.MAGIC) + 2:
+            raise cls.Error('Not a CPL AST file')
+        version, = struct.unpack_from('<H', header, len(cls.MAGIC))
+        if version != cls.VERSION:
+            raise cls.Error(f'Unsupported AST file version {version}, expected {cls.VERSION}')
+
+        try:
+            with utils.gc_paused():
+                return cls._load_body(zlib.decompress(input_file.read()))
+        except Exception as e:
+            # Whatever the decoding trips over, the file doesn't describe a valid program
+            raise cls.Error(f'Corrupt AST file ({type(e).__name__}: {e})') from None
+
+    @classmethod
+    def _load_body(cls, body):
+        (strings_size, num_strings, num_variables, num_tags,
+         num_args, num_floats) = cls.COUNTS.unpack_from(body)
+
+        offset = cls.COUNTS.size
+        strings = body[offset:offset + strings_size].decode().split('\0') if num_strings > 0 else []
+        offset += strings_size
+        type_codes = body[offset:offset + num_variables]
+        offset += num_variables
+        tags = body[offset:offset + num_tags]
+        offset += num_tags
+
+        columns = []
+        for typecode, count in [('q', num_args), ('d', num_floats)]:
+            column = array(typecode)
+            column.frombytes(body[offset:offset + count * column.itemsize])
+            offset += count * column.itemsize
+            if len(column) != count:
+                raise ValueError('truncated column')
+            if sys.byteorder != 'little':
+                column.byteswap()
+            columns.append(column.tolist())
+        args, floats = columns
+
+        variables = {}
+        variable_list = []
+        for name, type_code in zip(strings, type_codes):
+            variable = Variable(name, cls.TYPES[type_code])
+            variables[name] = variable
+            variable_list.append(variable)
+
+        operators = cls.OPERATORS
+        operator_tag_base = cls.OPERATOR_TAG_BASE
+        expression_types = (Operator, Use, Immediate)
+        nodes = [None]
+        # Indices of the statements with a break that no loop or switch in them encloses
+        breaking = set()
+
+        def item(sequence, index, what):
+            # Negative indices would silently wrap around
+            if not 0 <= index < len(sequence):
+                raise ValueError(f'{what} index {index} out of range')
+            return sequence[index]
+
+        def child(index):
+            # Children come before their parents, index 0 stands for a missing node
+            if not 0 < index < len(nodes):
+                raise ValueError(f'node index {index} out of range')
+            return nodes[index]
+
+        def optional_child(index):
+            # Only statements (the bodies of ifs and whiles) and default case values can be missing
+            return None if index == 0 else child(index)
+
+        def expression(index):
+            node = child(index)
+            if not isinstance(node, expression_types):
+                raise ValueError(f'node {index} is not an expression')
+            return node
+
+        a = 0
+        f = 0
+        for tag in tags:
+            # The most frequent nodes check their indices inline, operators check
+            # that their operands are expressions themselves
+            if tag >= operator_tag_base:
+                op = operators[tag - operator_tag_base]
+                if issubclass(op, UnaryOperator):
+                    i = args[a]
+                    if not 0 < i < len(nodes):
+                        raise ValueError(f'node index {i} out of range')
+                    node = op(nodes[i])
+                    a += 1
+                else:
+                    i = args[a]
+                    j = args[a + 1]
+                    if not (0 < i < len(nodes) and 0 < j < len(nodes)):
+                        raise ValueError(f'node index {i} or {j} out of range')
+                    node = op(nodes[i], nodes[j])
+                    a += 2
+            elif tag == cls.USE:
+                i = args[a]
+                if not 0 <= i < len(variable_list):
+                    raise ValueError(f'variable index {i} out of range')
+                node = Use(variable_list[i])
+                a += 1
+            elif tag == cls.INT:
+                node = Immediate(args[a])
+                a += 1
+            elif tag == cls.FLOAT:
+                node = Immediate(floats[f])
+                f += 1
+            elif tag == cls.LIST:
+                count = args[a]
+                if count < 0:
+                    raise ValueError(f'negative list length {count}')
+                indices = args[a + 1:a + 1 + count]
+                node = [child(i) for i in indices]
+                if len(node) != count:
+                    raise ValueError('truncated statement list')
+                if any(i in breaking for i in indices):
+                    breaking.add(len(nodes))
+                a += 1 + count
+            elif tag == cls.STATIC_CAST:
+                node = StaticCast(expression(args[a + 1]), item(cls.TYPES, args[a], 'type'))
+                a += 2
+            elif tag == cls.CONDITIONAL:
+                node = Conditional(expression(args[a]), optional_child(args[a + 1]), optional_child(args[a + 2]))
+                if args[a + 1] in breaking or args[a + 2] in breaking:
+                    breaking.add(len(nodes))
+                a += 3
+            elif tag == cls.WHILE:
+                node = While(expression(args[a]), optional_child(args[a + 1]))
+                a += 2
+            elif tag == cls.SWITCH:
+                value = expression(args[a])
+                num_cases = args[a + 1]
+                a += 2
+                cases = []
+                for _ in range(num_cases):
+                    case_value = optional_child(args[a])
+                    if case_value is not None and (type(case_value) is not Immediate
+                                                   or case_value.get_type() is not value.get_type()):
+                        raise ValueError(f'case value {args[a]} is not an immediate of the switch type')
+                    case_stmts = child(args[a + 1])
+                    if type(case_stmts) is not list:
+                        raise ValueError(f'case body {args[a + 1]} is not a statement list')
+                    cases.append(Case(case_stmts, case_value))
+                    a += 2
+                node = Switch(value, cases)
+            elif tag == cls.BREAK:
+                node = Break()
+                breaking.add(len(nodes))
+            elif tag == cls.INPUT:
+                node = Input(item(variable_list, args[a], 'variable'))
+                a += 1
+            elif tag == cls.OUTPUT:
+                node = Output(expression(args[a]))
+                a += 1
+            elif tag == cls.BIG_INT:
+                node = Immediate(int(item(strings, args[a], 'string')))
+                a += 1
+            else:
+                raise ValueError(f'unknown tag {tag}')
+            nodes.append(node)
+
+        if type(nodes[-1]) is not list:
+            raise ValueError('the last node is not a statement list')
+        if len(nodes) - 1 in breaking:
+            raise ValueError('break outside of a while-loop or switch-case')
+
+        return nodes[-1], variables
+
+    @staticmethod
+    def _children(obj):
+        if type(obj) is list:
+            return obj
+        if isinstance(obj, Operator):
+            return obj.operands
+        if isinstance(obj, Conditional):
+            return [obj.condition, obj.true_case, obj.false_case]
+        if isinstance(obj, While):
+            return [obj.condition, obj.body]
+        if isinstance(obj, Switch):
+            children = [obj.value]
+            for case in obj.cases:
+                children += [case.value, case.stmts]
+            return children
+        if isinstance(obj, Output):
+            return [obj.expr]
+        return ()
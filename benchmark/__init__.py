@@ -0,0 +1,8 @@
+"""
+Benchmarks for the compiler phases.
+
+Run `python -m benchmark` from the repository root to time the lexer, parser
+and code generator on generated programs, `python -m benchmark.generator` to
+print a generated program and `python -m benchmark.lexers` to compare the
+lexer engines.
+"""
@@ -0,0 +1,155 @@
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from lexer import Lexer
+from parser import Parser
+from optimizer import fold_constants
+from codegen import CodeGenerator
+from benchmark.generator import SHAPES, generate
+
+
+PHASES = ['lex', 'parse', 'optimize', 'gen']
+
+
+def source_stream(text, name):
+    stream = io.StringIO(text)
+    stream.name = name
+    return stream
+
+
+def best_time(func, repeat, setup=None):
+    # setup() runs untimed before each run, and its result is passed to func()
+    best = None
+    for _ in range(repeat):
+        args = [setup()] if setup is not None else []
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def run_case(shape, num_stmts, seed, repeat):
+    text = generate(shape, num_stmts, seed)
+    name = f'<{shape}:{num_stmts}:{seed}>'
+
+    lex_time, tokens = best_time(lambda: Lexer(source_stream(text, name)).tokens(), repeat)
+
+    # Parser.parse() lexes its input as well, so 'parse' includes 'lex'
+    def parse():
+        return Parser(source_stream(text, name)).parse()
+    parse_time, stmts = best_time(parse, repeat)
+
+    # Passes update the AST in place, so each run gets a freshly parsed one
+    optimize_time, _ = best_time(fold_constants, repeat, setup=parse)
+    fold_constants(stmts)
+
+    def gen():
+        output = io.StringIO()
+        CodeGenerator('quad').gen(stmts, output)
+        return output.getvalue()
+    gen_time, output = best_time(gen, repeat)
+
+    return {
+        'shape': shape,
+        'num_stmts': num_stmts,
+        'seed': seed,
+        'source_bytes': len(text),
+        'tokens': len(tokens),
+        'instructions': output.count('\n'),
+        'seconds': {
+            'lex': lex_time,
+            'parse': parse_time,
+            'optimize': optimize_time,
+            'gen': gen_time,
+        },
+    }
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(case):
+    return case['shape'], case['num_stmts'], case['seed']
+
+
+def compare(baseline, results, threshold):
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    regressions = 0
+
+    print(f'{"shape":<22} {"stmts":>6} ' + ' '.join(f'{phase:>8}' for phase in PHASES))
+    for case in results['cases']:
+        old_case = baseline_cases.get(case_key(case))
+        if old_case is None:
+            continue
+
+        ratios = []
+        for phase in PHASES:
+            if phase not in old_case['seconds']:
+                ratios.append(f'{"-":>8}')
+                continue
+            ratio = case['seconds'][phase] / old_case['seconds'][phase]
+            marker = '!' if ratio > 1 + threshold else ' '
+            regressions += marker == '!'
+            ratios.append(f'{ratio:>7.2f}{marker}')
+        print(f'{case["shape"]:<22} {case["num_stmts"]:>6} ' + ' '.join(ratios))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description='Time each compiler phase on generated CPL programs')
+    parser.add_argument('-s', '--shape', action='append', choices=SHAPES,
+                        help='Program shapes to run, defaults to all of them')
+    parser.add_argument('-n', '--num-stmts', type=int, action='append',
+                        help='Program sizes in top-level statements, defaults to 100 and 500')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the program generator')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per phase, the best one is recorded')
+    parser.add_argument('-o', '--output-file', help='Write the results as JSON to this path')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown that counts as a regression when comparing')
+    args = parser.parse_args()
+
+    results = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'cases': [],
+    }
+
+    print(f'{"shape":<22} {"stmts":>6} {"bytes":>9} {"tokens":>8} ' + ' '.join(f'{phase:>8}' for phase in PHASES))
+    for shape in args.shape or list(SHAPES):
+        for num_stmts in args.num_stmts or [100, 500]:
+            case = run_case(shape, num_stmts, args.seed, args.repeat)
+            results['cases'].append(case)
+            times = ' '.join(f'{case["seconds"][phase]:>8.4f}' for phase in PHASES)
+            print(f'{shape:<22} {num_stmts:>6} {case["source_bytes"]:>9} {case["tokens"]:>8} {times}')
+
+    if args.output_file is not None:
+        with open(args.output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(baseline, results, args.threshold) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
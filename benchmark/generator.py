@@ -0,0 +1,186 @@
+import argparse
+import random
+
+
+class ProgramGenerator:
+    """
+    Generates random, valid CPL programs.
+
+    Expressions are kept type-homogeneous (int expressions only read int
+    variables and float expressions only read float variables), with
+    static_cast bridging between the two, so every program passes semantic
+    analysis.
+    """
+
+    DEFAULTS = {
+        'num_int_vars': 8,
+        'num_float_vars': 4,
+        'expr_depth': 4,
+        'stmt_depth': 3,
+        'block_size': 4,
+        'switch_width': 4,
+        'weights': {
+            'assign': 6,
+            'input': 1,
+            'output': 2,
+            'if': 2,
+            'while': 1,
+            'switch': 1,
+        },
+    }
+
+    INT_OPS = ['+', '-', '*', '/']
+    COMPARE_OPS = ['==', '!=', '<', '>', '<=', '>=']
+    LOGIC_OPS = ['&&', '||']
+
+    def __init__(self, seed=0, **params):
+        unknown = set(params) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f'Unknown generator parameters: {", ".join(sorted(unknown))}')
+
+        self.params = dict(self.DEFAULTS, **params)
+        self._random = random.Random(seed)
+        self._int_vars = [f'i{n}' for n in range(self.params['num_int_vars'])]
+        self._float_vars = [f'f{n}' for n in range(self.params['num_float_vars'])]
+
+    def program(self, num_stmts):
+        lines = []
+        if self._int_vars:
+            lines.append(f'{", ".join(self._int_vars)} : int;')
+        if self._float_vars:
+            lines.append(f'{", ".join(self._float_vars)} : float;')
+
+        lines.append('{')
+        for _ in range(num_stmts):
+            self._stmt(lines, 1, self.params['stmt_depth'])
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def _stmt(self, lines, indent, depth):
+        kinds = list(self.params['weights'].items())
+        if depth == 0:
+            kinds = [(kind, weight) for kind, weight in kinds if kind not in ['if', 'while', 'switch']]
+        if not self._int_vars:
+            kinds = [(kind, weight) for kind, weight in kinds if kind != 'switch']
+        kind = self._random.choices([k for k, _ in kinds], [w for _, w in kinds])[0]
+
+        pad = '    ' * indent
+        if kind == 'assign':
+            var, type_name = self._variable()
+            lines.append(f'{pad}{var} = {self._expr(type_name, self.params["expr_depth"])};')
+
+        elif kind == 'input':
+            var, _ = self._variable()
+            lines.append(f'{pad}input({var});')
+
+        elif kind == 'output':
+            lines.append(f'{pad}output({self._expr(self._type(), self.params["expr_depth"])});')
+
+        elif kind == 'if':
+            lines.append(f'{pad}if ({self._condition()}) {{')
+            self._block(lines, indent + 1, depth - 1)
+            if self._random.random() < 0.5:
+                lines.append(f'{pad}}} else {{')
+                self._block(lines, indent + 1, depth - 1)
+            lines.append(f'{pad}}}')
+
+        elif kind == 'while':
+            lines.append(f'{pad}while ({self._condition()}) {{')
+            self._block(lines, indent + 1, depth - 1)
+            if self._random.random() < 0.3:
+                lines.append(f'{pad}    break;')
+            lines.append(f'{pad}}}')
+
+        elif kind == 'switch':
+            lines.append(f'{pad}switch ({self._random.choice(self._int_vars)}) {{')
+            values = self._random.sample(range(4 * self.params['switch_width']), self.params['switch_width'])
+            default_index = self._random.randrange(len(values) + 1)
+            for i, value in enumerate(values + [None]):
+                if i == default_index:
+                    lines.append(f'{pad}    default:')
+                    self._block(lines, indent + 2, depth - 1)
+                if value is not None:
+                    lines.append(f'{pad}    case {value}:')
+                    self._block(lines, indent + 2, depth - 1)
+                    if self._random.random() < 0.8:
+                        lines.append(f'{pad}        break;')
+            lines.append(f'{pad}}}')
+
+    def _block(self, lines, indent, depth):
+        for _ in range(self._random.randint(1, self.params['block_size'])):
+            self._stmt(lines, indent, depth)
+
+    def _type(self):
+        if not self._float_vars:
+            return 'int'
+        if not self._int_vars:
+            return 'float'
+        return self._random.choice(['int', 'float'])
+
+    def _variable(self):
+        type_name = self._type()
+        pool = self._int_vars if type_name == 'int' else self._float_vars
+        return self._random.choice(pool), type_name
+
+    def _condition(self):
+        type_name = self._type()
+        depth = max(1, self.params['expr_depth'] // 2)
+        cond = f'{self._expr(type_name, depth)} {self._random.choice(self.COMPARE_OPS)} {self._expr(type_name, depth)}'
+        if self._random.random() < 0.3:
+            cond = f'{cond} {self._random.choice(self.LOGIC_OPS)} !{self._leaf("int")}'
+        return cond
+
+    def _expr(self, type_name, depth):
+        if depth <= 0 or self._random.random() < 0.2:
+            return self._leaf(type_name)
+
+        choice = self._random.random()
+        if choice < 0.1:
+            other = 'float' if type_name == 'int' else 'int'
+            if (self._float_vars if other == 'float' else self._int_vars):
+                return f'static_cast<{type_name}>({self._expr(other, depth - 1)})'
+        if choice < 0.2:
+            return f'-({self._expr(type_name, depth - 1)})'
+
+        lhs = self._expr(type_name, depth - 1)
+        rhs = self._expr(type_name, depth - 1)
+        return f'({lhs} {self._random.choice(self.INT_OPS)} {rhs})'
+
+    def _leaf(self, type_name):
+        pool = self._int_vars if type_name == 'int' else self._float_vars
+        if pool and self._random.random() < 0.7:
+            return self._random.choice(pool)
+        if type_name == 'int':
+            return str(self._random.randint(0, 100))
+        return f'{self._random.randint(0, 100)}.{self._random.randint(0, 99)}'
+
+
+# Each shape stresses a different part of the front-end and the code generator
+SHAPES = {
+    'balanced': {},
+    'deep_expressions': {'expr_depth': 10, 'stmt_depth': 1},
+    'long_statement_lists': {'expr_depth': 2, 'stmt_depth': 0},
+    'nested_while': {'stmt_depth': 8, 'block_size': 2,
+                     'weights': {'assign': 2, 'output': 1, 'while': 4}},
+    'wide_switch': {'switch_width': 32, 'stmt_depth': 1,
+                    'weights': {'assign': 1, 'switch': 2}},
+    'many_declarations': {'num_int_vars': 2000, 'num_float_vars': 2000, 'stmt_depth': 1},
+}
+
+
+def generate(shape, num_stmts, seed=0):
+    return ProgramGenerator(seed, **SHAPES[shape]).program(num_stmts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a random CPL program')
+    parser.add_argument('-s', '--shape', choices=SHAPES, default='balanced', help='Program shape')
+    parser.add_argument('-n', '--num-stmts', type=int, default=100, help='Number of top-level statements')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    print(generate(args.shape, args.num_stmts, args.seed), end='')
+
+
+if __name__ == '__main__':
+    main()
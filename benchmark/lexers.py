@@ -0,0 +1,50 @@
+import argparse
+import io
+import time
+
+import utils
+from lexer import Lexer, RegexLexer
+
+
+LEXERS = {
+    'loop': Lexer,
+    'regex': RegexLexer,
+}
+
+
+def measure(lexer_class, text, name, repeat):
+    best_time = None
+    for _ in range(repeat):
+        stream = io.StringIO(text)
+        stream.name = name
+
+        start = time.perf_counter()
+        num_tokens = len(lexer_class(stream).tokens())
+        elapsed = time.perf_counter() - start
+
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return num_tokens, best_time
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.lexers',
+                                     description='Compare the throughput of the lexer engines')
+    parser.add_argument('input_file', nargs='+', help='Input files')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per lexer, the best one is reported')
+    args = parser.parse_args()
+
+    print(f'{"file":<32} {"lexer":<8} {"tokens":>10} {"seconds":>10} {"MB/s":>8} {"Ktok/s":>8}')
+    for input_path in args.input_file:
+        with utils.smart_open(input_path, 'r') as input_file:
+            text = input_file.read()
+
+        for lexer_name, lexer_class in LEXERS.items():
+            num_tokens, elapsed = measure(lexer_class, text, input_path, args.repeat)
+            mb_per_sec = len(text) / elapsed / 1e6
+            ktok_per_sec = num_tokens / elapsed / 1e3
+            print(f'{input_path:<32} {lexer_name:<8} {num_tokens:>10} {elapsed:>10.3f} {mb_per_sec:>8.2f} {ktok_per_sec:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
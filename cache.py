@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+
+
+def compiler_version():
+    # Every module of the compiler is hashed, rather than a list of the ones
+    # that affect the generated code, which is easy to forget to update
+    h = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                contents = f.read()
+            for part in [name.encode(), contents]:
+                h.update(len(part).to_bytes(8, 'little'))
+                h.update(part)
+    return h.hexdigest()
+
+
+class CompileCache:
+    """
+    Content-addressed on-disk cache of generated code.
+
+    Entries are keyed by a hash of the source, the compiler version and the
+    back-end name. The least recently used entries are evicted once the
+    cache grows past max_size bytes.
+    """
+
+    ENTRY_SUFFIX = '.out'
+    TEMP_PREFIX = '.tmp-'
+
+    # Evicting down to a low-water mark keeps directory scans infrequent
+    EVICTION_RATIO = 0.9
+
+    def __init__(self, directory, max_size, version=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version if version is not None else compiler_version()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._total_size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, backend_name):
+        h = hashlib.sha256()
+        for part in [self.version.encode(), backend_name.encode(), source]:
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        return h.hexdigest()
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', newline='') as f:
+                output = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # Entries are evicted in order of last use
+        os.utime(path)
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        path = self._entry_path(key)
+        existed = os.path.exists(path)
+
+        # Write to a temporary file first so that readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=self.TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'w', newline='') as f:
+                f.write(output)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.stores += 1
+
+        if self._total_size is not None and not existed:
+            self._total_size += size
+        self._evict_if_needed()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + self.ENTRY_SUFFIX)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(self.ENTRY_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict_if_needed(self):
+        if self._total_size is None:
+            self._total_size = sum(size for _, size, _ in self._entries())
+        if self._total_size <= self.max_size:
+            return
+
+        entries = sorted(self._entries())
+        self._total_size = sum(size for _, size, _ in entries)
+        target_size = self.max_size * self.EVICTION_RATIO
+        for _, size, path in entries:
+            if self._total_size <= target_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._total_size -= size
+            self.evictions += 1
@@ -0,0 +1,271 @@
+from ir import *
+
+
+class Loop:
+    """A natural loop, with the loops of the same header merged."""
+
+    __slots__ = ('header', 'latches', 'parent', 'children', 'own_blocks', '_preorder', '_postorder')
+
+    def __init__(self, header):
+        self.header = header
+        # Blocks with a back edge to the header
+        self.latches = []
+        # The innermost loop that contains this one, or None
+        self.parent = None
+        self.children = []
+        # The blocks of the loop that aren't in a nested loop, the header first
+        self.own_blocks = [header]
+        # Numbers of the loop nesting tree, see ControlFlowGraph.loop_contains()
+        self._preorder = None
+        self._postorder = None
+
+    def blocks(self):
+        """Yields all the blocks of the loop, including those of nested loops."""
+        stack = [self]
+        while len(stack) > 0:
+            loop = stack.pop()
+            yield from loop.own_blocks
+            stack.extend(loop.children)
+
+    def contains_loop(self, other):
+        # Whether other is this loop, or nested in it
+        return self._preorder <= other._preorder and other._postorder <= self._postorder
+
+
+class ControlFlowGraph:
+    """
+    Control flow between the basic-blocks of the IR, as emitted by the code
+    generator: the successors and predecessors of each block, its immediate
+    dominator and the natural loops.
+
+    Blocks must end with their only Jump or CondBr, or with the Halt, or else
+    fall through to the next block. Everything is computed in (nearly) linear
+    time, however deeply statements are nested, and without recursing in Python.
+    """
+
+    def __init__(self, basic_blocks, label_to_bb):
+        self.blocks = basic_blocks
+        self.entry = basic_blocks[0]
+        # The block that halts the program
+        self.exit = None
+        self._build_edges(label_to_bb)
+
+        # Blocks reachable from the entry, in depth-first preorder and postorder
+        self.postorder = []
+        self.preorder = self._depth_first_preorder()
+        # Immediate dominator of each reachable block, None for the entry
+        self.idom = self._compute_dominators()
+        self.dominator_tree = self._number_dominator_tree()
+        # Natural loops, each one before the loops nested in it
+        self.loops = self._find_loops()
+
+    def _build_edges(self, label_to_bb):
+        for bb in self.blocks:
+            bb.successors = []
+            bb.predecessors = []
+
+        for i, bb in enumerate(self.blocks):
+            last_instr = bb.instructions[-1] if len(bb.instructions) > 0 else None
+            opcode = last_instr[0] if last_instr is not None else None
+            if opcode is Jump:
+                targets = [label_to_bb[last_instr[2]]]
+            elif opcode is CondBr:
+                targets = [label_to_bb[last_instr[3]], label_to_bb[last_instr[4]]]
+            elif opcode is Halt:
+                targets = []
+                self.exit = bb
+            elif i + 1 < len(self.blocks):
+                targets = [self.blocks[i + 1]]
+            else:
+                targets = []
+
+            for target in targets:
+                if target not in bb.successors:
+                    bb.successors.append(target)
+                    target.predecessors.append(bb)
+
+    def _depth_first_preorder(self):
+        # Also records the parent of each block in the depth-first spanning tree
+        preorder = [self.entry]
+        self._dfs_number = {self.entry: 0}
+        self._dfs_parent = [None]
+        stack = [(self.entry, iter(self.entry.successors))]
+        while len(stack) > 0:
+            bb, successors = stack[-1]
+            for succ in successors:
+                if succ not in self._dfs_number:
+                    self._dfs_number[succ] = len(preorder)
+                    self._dfs_parent.append(self._dfs_number[bb])
+                    preorder.append(succ)
+                    stack.append((succ, iter(succ.successors)))
+                    break
+            else:
+                stack.pop()
+                self.postorder.append(bb)
+        return preorder
+
+    def _compute_dominators(self):
+        # Lengauer and Tarjan's algorithm (the simple version, with path
+        # compression) over the depth-first numbers of the blocks
+        number = self._dfs_number
+        parent = self._dfs_parent
+        count = len(self.preorder)
+        semi = list(range(count))
+        idom = [0] * count
+        ancestor = [-1] * count
+        label = list(range(count))
+        buckets = [[] for _ in range(count)]
+
+        def evaluate(v):
+            # The vertex with the smallest semidominator on the path from v up to
+            # (but excluding) the root of its tree in the forest
+            if ancestor[v] == -1:
+                return v
+            path = []
+            while ancestor[ancestor[v]] != -1:
+                path.append(v)
+                v = ancestor[v]
+            while len(path) > 0:
+                v = path.pop()
+                a = ancestor[v]
+                if semi[label[a]] < semi[label[v]]:
+                    label[v] = label[a]
+                ancestor[v] = ancestor[a]
+            return label[v]
+
+        for w in range(count - 1, 0, -1):
+            for pred in self.preorder[w].predecessors:
+                v = number.get(pred)
+                if v is None:
+                    continue
+                u = evaluate(v)
+                if semi[u] < semi[w]:
+                    semi[w] = semi[u]
+            buckets[semi[w]].append(w)
+            ancestor[w] = parent[w]
+            for v in buckets[parent[w]]:
+                u = evaluate(v)
+                idom[v] = u if semi[u] < semi[v] else parent[w]
+            buckets[parent[w]] = []
+
+        for w in range(1, count):
+            if idom[w] != semi[w]:
+                idom[w] = idom[idom[w]]
+
+        idoms = {self.entry: None}
+        for w in range(1, count):
+            idoms[self.preorder[w]] = self.preorder[idom[w]]
+        return idoms
+
+    def _number_dominator_tree(self):
+        # Pre- and post-order numbers of the dominator tree answer dominates() in O(1)
+        children = {bb: [] for bb in self.preorder}
+        for bb in self.preorder[1:]:
+            children[self.idom[bb]].append(bb)
+
+        self._dominator_preorder = {}
+        self._dominator_postorder = {}
+        counter = 0
+        stack = [(self.entry, False)]
+        while len(stack) > 0:
+            bb, done = stack.pop()
+            counter += 1
+            if done:
+                self._dominator_postorder[bb] = counter
+                continue
+            self._dominator_preorder[bb] = counter
+            stack.append((bb, True))
+            stack.extend((child, False) for child in reversed(children[bb]))
+        return children
+
+    def dominates(self, a, b):
+        """Whether every path from the entry to block b goes through block a."""
+        if b not in self._dominator_preorder:
+            # Nothing is said about unreachable blocks
+            return False
+        return (self._dominator_preorder[a] <= self._dominator_preorder[b]
+                and self._dominator_postorder[b] <= self._dominator_postorder[a])
+
+    def is_reachable(self, bb):
+        return bb in self._dfs_number
+
+    def _find_loops(self):
+        # Tarjan's loop nesting forest: headers are visited innermost first (in
+        # decreasing depth-first order) and each loop's body is collected
+        # backwards from its latches, where the blocks of the nested loops found
+        # so far are collapsed into their header with a union-find
+        number = self._dfs_number
+        representative = list(range(len(self.preorder)))
+
+        def find(v):
+            root = v
+            while representative[root] != root:
+                root = representative[root]
+            while representative[v] != root:
+                representative[v], v = root, representative[v]
+            return root
+
+        loops_by_header = {}
+        self._innermost_loop = {}
+        for h in range(len(self.preorder) - 1, -1, -1):
+            header = self.preorder[h]
+            latches = [pred for pred in header.predecessors
+                       if pred in number and self.dominates(header, pred)]
+            if len(latches) == 0:
+                continue
+
+            loop = loops_by_header[header] = Loop(header)
+            loop.latches = latches
+            self._innermost_loop[header] = loop
+
+            body = []
+            seen = {h}
+            worklist = [find(number[latch]) for latch in latches]
+            while len(worklist) > 0:
+                v = worklist.pop()
+                if v in seen:
+                    continue
+                seen.add(v)
+                body.append(v)
+                bb = self.preorder[v]
+                inner_loop = loops_by_header.get(bb)
+                if inner_loop is not None and inner_loop.parent is None:
+                    inner_loop.parent = loop
+                    loop.children.append(inner_loop)
+                else:
+                    loop.own_blocks.append(bb)
+                    self._innermost_loop[bb] = loop
+                for pred in bb.predecessors:
+                    # Only the header can be entered from outside the loop, unless
+                    # the flow graph is irreducible (which CPL can't produce)
+                    if pred in number and self.dominates(header, pred):
+                        worklist.append(find(number[pred]))
+
+            for v in body:
+                representative[v] = h
+
+        # Numbering the loop nesting tree answers loop_contains() in O(1)
+        loops = []
+        counter = 0
+        roots = [loop for loop in loops_by_header.values() if loop.parent is None]
+        stack = [(loop, False) for loop in reversed(roots)]
+        while len(stack) > 0:
+            loop, done = stack.pop()
+            counter += 1
+            if done:
+                loop._postorder = counter
+                continue
+            loop._preorder = counter
+            loops.append(loop)
+            stack.append((loop, True))
+            stack.extend((child, False) for child in reversed(loop.children))
+        return loops
+
+    def loop_of(self, bb):
+        """The innermost loop that contains block bb, or None."""
+        return self._innermost_loop.get(bb)
+
+    def loop_contains(self, loop, bb):
+        """Whether block bb is in loop, or in a loop nested in it."""
+        inner_loop = self._innermost_loop.get(bb)
+        return inner_loop is not None and loop.contains_loop(inner_loop)
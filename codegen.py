@@ -1,11 +1,57 @@
-import re
+import importlib
+import sys
+from types import GeneratorType
+
+import utils
 from ir import *
+from cfg import ControlFlowGraph
+from passes import (Liveness, eliminate_dead_code, eliminate_common_subexpressions, hoist_loop_invariants,
+                    allocate_temporaries)
+from peephole import Peephole
+from instrumentation import NULL_INSTRUMENTATION
 
 
 class Value:
-    def __init__(self, name, type_class):
+    __slots__ = ('name', 'type_class', 'temporary')
+
+    def __init__(self, name, type_class, temporary=False):
         self.name = name
         self.type_class = type_class
+        # Temporaries are created once by the code generator and shared by all
+        # the instructions that use them, so they can be renamed in place
+        self.temporary = temporary
+
+    def get_type(self):
+        return self.type_class
+
+
+class Label:
+    # A reference to the basic-block of a label, in back-end instructions
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return f'<{self.name}>'
+
+
+class Instruction:
+    """
+    A back-end instruction: its opcode, followed by operands that are names,
+    numbers or Labels. Labels are replaced by addresses before it is printed.
+    """
+
+    __slots__ = ('opcode', 'operands')
+
+    def __init__(self, opcode, *operands):
+        self.opcode = opcode
+        self.operands = operands
+
+    def __str__(self):
+        if len(self.operands) == 0:
+            return self.opcode
+        return f'{self.opcode} {" ".join(map(str, self.operands))}'
 
 
 class BasicBlock:
@@ -14,6 +60,9 @@ class BasicBlock:
         self.label = None
         self.address = None
         self.instructions = []
+        # Edges of the control flow graph, see cfg.ControlFlowGraph
+        self.successors = []
+        self.predecessors = []
 
 
 class CodeGenerator:
@@ -21,42 +70,139 @@ class CodeGenerator:
     class Error(Exception):
         pass
 
-    def __init__(self, backend_name):
+    # Instructions are written out in batches of roughly this many characters
+    WRITE_BATCH_SIZE = 1 << 16
+
+    # Back-ends by name, as (module, class), which are only imported when used.
+    # A back-end maps each IR instruction to Instructions with map_instruction(),
+    # and names its unconditional jump (JUMP_OPCODE) and branches (BRANCH_OPCODES).
+    # Its PEEPHOLE_RULES rewrite the mapped instructions, see peephole.Peephole,
+    # where the opcodes in READING_OPCODES don't write their first operand.
+    BACKENDS = {
+        'quad': ('quad', 'Quad'),
+    }
+
+    # Switches with more distinct case values than this are dispatched by a binary search
+    LINEAR_SWITCH_MAX_CASES = 4
+
+    def __init__(self, backend_name, instrumentation=NULL_INSTRUMENTATION):
         self._t = 0
         self._l = 0
         self._break_to_labels = []
         self._backend_name = backend_name.lower()
+        # The back-end's class, once instructions are selected
+        self._backend = None
+        # Built once the IR is emitted
+        self._cfg = None
         self._basic_blocks = []
         self._init_new_bb()
         self._label_to_bb = {}
-
-    def gen(self, stmts):
-        # Emit IR instructions and labels into a list of basic-blocks
-        self._emit(stmts)
-        # Program must end with a HALT instruction
-        self._emit(Halt())
-
+        self._instrumentation = instrumentation
+
+    def gen(self, stmts, output_file=None):
+        instrumentation = self._instrumentation
+
+        with instrumentation.phase('emit'):
+            # Emit IR instructions and labels into a list of basic-blocks
+            self._emit(stmts)
+            # Program must end with a HALT instruction
+            self._emit(Halt())
+
+        with instrumentation.phase('remove-empty-basic-blocks'):
+            self._remove_empty_basic_blocks()
+        with instrumentation.phase('build-cfg'):
+            self._cfg = ControlFlowGraph(self._basic_blocks, self._label_to_bb)
+        with instrumentation.phase('eliminate-dead-code'):
+            unreachable_blocks, dead_instrs = eliminate_dead_code(self._cfg)
+            self._rebuild_cfg()
+        instrumentation.count('unreachable-blocks', unreachable_blocks)
+        instrumentation.count('dead-instructions', dead_instrs)
+        with instrumentation.phase('eliminate-common-subexpressions'):
+            reused_results = eliminate_common_subexpressions(self._cfg, across_blocks=True)
+            self._rebuild_cfg()
+        with instrumentation.phase('hoist-loop-invariants'):
+            hoisted_instrs = hoist_loop_invariants(self._cfg, self._insert_preheader)
+            self._rebuild_cfg()
+        if hoisted_instrs > 0:
+            # The same expression may have been hoisted out of several loops into one preheader
+            with instrumentation.phase('eliminate-common-subexpressions'):
+                reused_results += eliminate_common_subexpressions(self._cfg, across_blocks=True)
+                self._rebuild_cfg()
+        instrumentation.count('common-subexpressions', reused_results)
+        instrumentation.count('hoisted-instructions', hoisted_instrs)
+        with instrumentation.phase('allocate-temporaries'):
+            used_temps, allocated_temps = allocate_temporaries(self._cfg)
+        instrumentation.count('saved-temporaries', used_temps - allocated_temps)
+        with instrumentation.phase('peephole'):
+            # Computed while the instructions are still IR
+            liveness = Liveness(self._cfg)
+        with instrumentation.phase('select-instructions'):
+            self._select_instructions()
+        with instrumentation.phase('peephole'):
+            peephole_hits = self._optimize_peephole(liveness)
+        for rule_name, hits in peephole_hits.items():
+            instrumentation.count(f'peephole-{rule_name}', hits)
+        with instrumentation.phase('remove-nop-jumps'):
+            self._remove_nop_jumps()
+        with instrumentation.phase('translate-labels'):
+            self._translate_labels()
+        with instrumentation.phase('print-instructions'):
+            self._print_instructions(output_file if output_file is not None else sys.stdout)
+
+        if instrumentation.enabled:
+            instrumentation.count('basic-blocks', len(self._basic_blocks))
+            instrumentation.count('temporaries', self._t)
+            instrumentation.count('loops', len(self._cfg.loops))
+            instrumentation.count('instructions', sum(len(bb.instructions) for bb in self._basic_blocks))
+
+    def _rebuild_cfg(self):
+        # After a pass that removed instructions or blocks, or added blocks
         self._remove_empty_basic_blocks()
-        self._select_instructions()
-        self._remove_nop_jumps()
-        self._translate_labels()
-        self._print_instructions()
+        self._cfg = ControlFlowGraph(self._basic_blocks, self._label_to_bb)
 
     def _remove_empty_basic_blocks(self):
-        for i in range(len(self._basic_blocks) - 1, -1, -1):
-            bb = self._basic_blocks[i]
+        # Labels of removed basic-blocks are redirected to the following one
+        basic_blocks = []
+        replacements = {}
+        for bb in reversed(self._basic_blocks):
             if len(bb.instructions) > 0:
+                basic_blocks.append(bb)
+            else:
+                replacements[bb] = basic_blocks[-1]
+        basic_blocks.reverse()
+        self._basic_blocks = basic_blocks
+
+        # Labels that were already redirected to a removed block are redirected again
+        if len(replacements) > 0:
+            for label, bb in self._label_to_bb.items():
+                if bb in replacements:
+                    self._label_to_bb[label] = replacements[bb]
+
+    def _insert_preheader(self, header, entries):
+        # A new block for the loop at header, which entries branch to instead.
+        # It is laid out by passes.hoist_loop_invariants(), right before header.
+        bb = BasicBlock(len(self._basic_blocks))
+        bb.label = self._gen_label()
+        self._label_to_bb[bb.label] = bb
+        for entry in entries:
+            last_instr = entry.instructions[-1]
+            if last_instr[0] is Jump:
+                label_indices = [2]
+            elif last_instr[0] is CondBr:
+                label_indices = [3, 4]
+            else:
+                # Falls through to the preheader
                 continue
-            if bb.label is not None:
-                next_bb = self._basic_blocks[i + 1]
-                self._label_to_bb[bb.label] = self._label_to_bb[next_bb.label]
-            self._basic_blocks.pop(i)
+            for i in label_indices:
+                if self._label_to_bb[last_instr[i]] is header:
+                    last_instr[i] = bb.label
+        return bb
 
     def _select_instructions(self):
-        if self._backend_name == 'quad':
-            from quad import Quad as backend
-        else:
+        if self._backend_name not in self.BACKENDS:
             raise self.Error(f'Unsupported back-end \'{self._backend_name}\'')
+        module_name, class_name = self.BACKENDS[self._backend_name]
+        backend = self._backend = getattr(importlib.import_module(module_name), class_name)
 
         for bb in self._basic_blocks:
             backend_instrs = []
@@ -64,15 +210,25 @@ class CodeGenerator:
                 backend_instrs += backend.map_instruction(ir_instr)
             bb.instructions = backend_instrs
 
+    def _optimize_peephole(self, liveness):
+        # Returns the number of times each rule was applied
+        peephole = Peephole(self._backend.PEEPHOLE_RULES, self._backend.READING_OPCODES)
+        for bb in self._basic_blocks:
+            bb.instructions = peephole.optimize(bb.instructions, liveness.live_out_names(bb))
+        # Rules may remove all the instructions of a block
+        self._remove_empty_basic_blocks()
+        return peephole.hits
+
     def _remove_nop_jumps(self):
         # Remove NOP jumps (JUMPs that jump to the next instruction) generated by the back-end
+        jump_opcode = self._backend.JUMP_OPCODE
         for bb_index in range(len(self._basic_blocks) - 1):
             src_bb = self._basic_blocks[bb_index]
             last_instr = src_bb.instructions[-1]
-            if not last_instr.startswith('JUMP'):
+            if last_instr.opcode != jump_opcode:
                 continue
-            label = re.findall(r'<(\w+)>', last_instr)[0]
-            dst_bb = self._label_to_bb[label]
+            label, = last_instr.operands
+            dst_bb = self._label_to_bb[label.name]
             if dst_bb is self._basic_blocks[bb_index + 1]:
                 src_bb.instructions.pop(-1)
 
@@ -82,25 +238,32 @@ class CodeGenerator:
         for bb in self._basic_blocks:
             bb.address = current_address
             bb.label = None
-            for instr in bb.instructions:
-                current_address += 1
+            current_address += len(bb.instructions)
 
-        # Convert the labels in branching instructions into addresses
+        # Replace the labels in branching instructions with addresses
+        label_to_bb = self._label_to_bb
+        branch_opcodes = self._backend.BRANCH_OPCODES
         for bb in self._basic_blocks:
-            for i, instr in enumerate(bb.instructions):
-                unresolved_labels = re.findall(r'<(\w+)>', instr)
-                resolved_labels = []
-                for label in unresolved_labels:
-                    dest_bb_address = self._label_to_bb[label].address
-                    resolved_labels.append(dest_bb_address)
-                resolved_instr = re.sub(r'<(\w+)>', '{}', instr).format(*resolved_labels)
-                bb.instructions[i] = resolved_instr
-
-    def _print_instructions(self):
+            for instr in bb.instructions:
+                if instr.opcode in branch_opcodes:
+                    instr.operands = tuple(label_to_bb[op.name].address if type(op) is Label else op
+                                           for op in instr.operands)
+
+    def _print_instructions(self, output_file):
+        batch = []
+        batch_size = 0
         for bb in self._basic_blocks:
             assert bb.label is None
-            for instr in bb.instructions:
-                print(instr)
+            text = ''.join(f'{instr}\n' for instr in bb.instructions)
+            batch.append(text)
+            batch_size += len(text)
+            if batch_size >= self.WRITE_BATCH_SIZE:
+                output_file.write(''.join(batch))
+                batch = []
+                batch_size = 0
+
+        if len(batch) > 0:
+            output_file.write(''.join(batch))
 
     def _init_new_bb(self):
         bb = BasicBlock(len(self._basic_blocks))
@@ -111,7 +274,7 @@ class CodeGenerator:
 
     def _gen_temp(self, type_class):
         self._t += 1
-        return Value(f't{self._t}', type_class)
+        return Value(f't{self._t}', type_class, temporary=True)
 
     def _gen_label(self):
         self._l += 1
@@ -131,136 +294,292 @@ class CodeGenerator:
         self._add_instr([CondBr, None, condition, true_label, false_label])
         self._init_new_bb()
 
-    def _emit(self, obj, dest=None):
-        # result is of type Value (defined at the start of the file)
-        result = None
-
-        if isinstance(obj, list):
-            for o in obj:
-                self._emit(o)
+    def _emit_switch_dispatch(self, value, cases, default_label):
+        # cases are (case value, body label) pairs with distinct values. Quad has
+        # no indirect jumps, so instead of a jump table, larger switches narrow
+        # down the case with a binary search over the sorted case values.
+        if len(cases) <= self.LINEAR_SWITCH_MAX_CASES:
+            self._emit_case_tests(value, cases, default_label)
+            return
+
+        cases = sorted(cases, key=lambda case: case[0].value)
+        stack = [(0, len(cases), None)]
+        while len(stack) > 0:
+            low, high, label = stack.pop()
+            if label is not None:
+                self._emit_label(label)
+            if high - low <= self.LINEAR_SWITCH_MAX_CASES:
+                self._emit_case_tests(value, cases[low:high], default_label)
+                continue
 
-        elif isinstance(obj, Value):
-            result = obj
+            middle = (low + high) // 2
+            low_label = self._gen_label()
+            high_label = self._gen_label()
+            test_result = self._emit_expr(Less(value, cases[middle][0]))
+            self._emit_conditional_branch(test_result, low_label, high_label)
+            # The lower half is emitted right after the test, so its jump is removed
+            stack.append((middle, high, high_label))
+            stack.append((low, middle, low_label))
+
+    def _emit_case_tests(self, value, cases, default_label):
+        # A chain of equality tests, falling back to default_label
+        if len(cases) == 0:
+            self._emit_jump(default_label)
+        for i, (case_value, body_label) in enumerate(cases):
+            is_last = i == len(cases) - 1
+            next_label = default_label if is_last else self._gen_label()
+            test_result = self._emit_expr(NotEqual(value, case_value))
+            self._emit_conditional_branch(test_result, next_label, body_label)
+            if not is_last:
+                self._emit_label(next_label)
 
-        elif isinstance(obj, Immediate):
-            result = Value(obj.value, obj.get_type())
+    def _emit(self, obj, dest=None):
+        # result is of type Value (defined at the start of the file)
+        if isinstance(obj, (Value, Immediate, Use, Operator)):
+            return self._emit_expr(obj, dest)
+        return utils.trampoline(self._emit_stmt(obj))
+
+    # Emitters of expression nodes by class, see _emit_expr()
+    _expr_emitters = utils.TypeDispatch()
+    # Emitters of statements by class, see _emit_stmt()
+    _stmt_emitters = utils.TypeDispatch()
+
+    def _emit_expr(self, expr, dest=None):
+        # Post-order walk over an explicit stack, emitting the same instructions and
+        # temporaries (in the same order) as a recursive walk would. Frames are
+        # (node, dest, stage), where stage counts the operands already emitted.
+        # Emitters either push the result onto values, or push the frames of
+        # their operands followed by their own next stage onto stack.
+        values = []
+        stack = [(expr, dest, 0)]
+        lookup = self._expr_emitters.lookup
+        while len(stack) > 0:
+            obj, dest, stage = stack.pop()
+            emitter = lookup(type(obj))
+            if emitter is None:
+                raise self.Error(f'Missing implemenation for generation of {obj}')
+            emitter(self, obj, dest, stage, stack, values)
+
+        return values[0]
+
+    @_expr_emitters.register(Value)
+    def _emit_value(self, obj, dest, stage, stack, values):
+        values.append(obj)
+
+    @_expr_emitters.register(Immediate)
+    def _emit_immediate(self, obj, dest, stage, stack, values):
+        result = Value(obj.value, obj.get_type())
+        if dest is not None:
+            self._add_instr([Assign, dest, result])
+            result = dest
+        values.append(result)
+
+    @_expr_emitters.register(Use)
+    def _emit_use(self, obj, dest, stage, stack, values):
+        result = Value(obj.variable.name, obj.variable.type_class)
+        if dest is not None:
+            self._add_instr([Assign, dest, result])
+            result = dest
+        values.append(result)
+
+    @_expr_emitters.register(Assign)
+    def _emit_assign(self, obj, dest, stage, stack, values):
+        # The lhs value is the result, the rhs is emitted straight into it
+        if stage == 0:
+            stack.append((obj, dest, 1))
+            stack.append((obj.operands[0], None, 0))
+        elif stage == 1:
+            stack.append((obj, dest, 2))
+            stack.append((obj.operands[1], values[-1], 0))
+        else:
+            values.pop()
             if dest is not None:
-                self._add_instr([Assign, dest, result])
-                result = dest
-
-        elif isinstance(obj, Use):
-            result = Value(obj.variable.name, obj.variable.type_class)
+                self._add_instr([Assign, dest, values[-1]])
+
+    @_expr_emitters.register(And, Or)
+    def _emit_short_circuit(self, obj, dest, stage, stack, values):
+        # Short-circuit evaluation, the rhs is skipped if the lhs decides the result
+        if stage == 0:
+            stack.append((obj, dest, 1))
+            stack.append((obj.operands[0], None, 0))
+        elif stage == 1:
+            arg1 = values.pop()
+            result = self._gen_temp(Integer)
+            rhs_label = self._gen_label()
+            end_label = self._gen_label()
+            self._add_instr([NotEqual, result, arg1, Value(arg1.type_class.ZERO, arg1.type_class)])
+            if isinstance(obj, And):
+                self._emit_conditional_branch(result, rhs_label, end_label)
+            else:
+                self._emit_conditional_branch(result, end_label, rhs_label)
+            self._emit_label(rhs_label)
+            # Kept below the rhs value until it has been emitted
+            values.append((result, end_label))
+            stack.append((obj, dest, 2))
+            stack.append((obj.operands[1], None, 0))
+        else:
+            arg2 = values.pop()
+            result, end_label = values.pop()
+            self._add_instr([NotEqual, result, arg2, Value(arg2.type_class.ZERO, arg2.type_class)])
+            self._emit_label(end_label)
             if dest is not None:
                 self._add_instr([Assign, dest, result])
                 result = dest
+            values.append(result)
 
-        elif isinstance(obj, UnaryOperator):
-            arg1 = self._emit(obj.operands[0])
+    @_expr_emitters.register(UnaryOperator)
+    def _emit_unary_operator(self, obj, dest, stage, stack, values):
+        if stage == 0:
+            stack.append((obj, dest, 1))
+            stack.append((obj.operands[0], None, 0))
+        else:
+            arg1 = values.pop()
             result = dest if dest is not None else self._gen_temp(obj.get_type())
             self._add_instr([type(obj), result, arg1])
-
-        elif isinstance(obj, BinaryOperator):
-            if isinstance(obj, Assign):
-                result = self._emit(obj.operands[0])
-                self._emit(obj.operands[1], result)
-                if dest is not None:
-                    self._add_instr([Assign, dest, result])
-            else:
-                arg1 = self._emit(obj.operands[0])
-                arg2 = self._emit(obj.operands[1])
-                result = dest if dest is not None else self._gen_temp(obj.get_type())
-                assert arg1.type_class is arg2.type_class
-                self._add_instr([type(obj), result, arg1, arg2])
-
-        elif isinstance(obj, Conditional):
-            cond_result = self._emit(obj.condition)
-            true_label = self._gen_label()
-            if obj.false_case is not None:
-                false_label = self._gen_label()
-                end_label = self._gen_label()
+            values.append(result)
+
+    @_expr_emitters.register(BinaryOperator)
+    def _emit_binary_operator(self, obj, dest, stage, stack, values):
+        if stage == 0:
+            stack.append((obj, dest, 1))
+            stack.append((obj.operands[1], None, 0))
+            stack.append((obj.operands[0], None, 0))
+        else:
+            arg2 = values.pop()
+            arg1 = values.pop()
+            result = dest if dest is not None else self._gen_temp(obj.get_type())
+            assert arg1.type_class is arg2.type_class
+            self._add_instr([type(obj), result, arg1, arg2])
+            values.append(result)
+
+    def _emit_condition(self, expr, true_label, false_label):
+        # Branches on the truth of expr. And, Or and Not only direct the control
+        # flow (short-circuiting), so their operands are never normalized to 0/1.
+        stack = [(expr, true_label, false_label, None)]
+        while len(stack) > 0:
+            expr, true_label, false_label, label = stack.pop()
+            if label is not None:
+                self._emit_label(label)
+
+            if isinstance(expr, And):
+                rhs_label = self._gen_label()
+                stack.append((expr.operands[1], true_label, false_label, rhs_label))
+                stack.append((expr.operands[0], rhs_label, false_label, None))
+            elif isinstance(expr, Or):
+                rhs_label = self._gen_label()
+                stack.append((expr.operands[1], true_label, false_label, rhs_label))
+                stack.append((expr.operands[0], true_label, rhs_label, None))
+            elif isinstance(expr, Not):
+                stack.append((expr.operands[0], false_label, true_label, None))
+            elif isinstance(expr, Immediate):
+                self._emit_jump(true_label if expr.value != 0 else false_label)
             else:
-                end_label = self._gen_label()
-                false_label = end_label
-
-            self._emit_conditional_branch(cond_result, true_label, false_label)
-            self._emit_label(true_label)
-            self._emit(obj.true_case)
+                result = self._emit_expr(expr)
+                self._emit_conditional_branch(result, true_label, false_label)
+
+    def _emit_stmt(self, obj):
+        # A generator run by utils.trampoline(), where "yield self._emit_stmt(...)"
+        # stands for a recursive call, so nesting depth doesn't grow the Python stack.
+        # Emitters of compound statements are generators themselves and are run
+        # the same way, the others return the result directly.
+        emitter = self._stmt_emitters.lookup(type(obj))
+        if emitter is None:
+            raise self.Error(f'Missing implemenation for generation of {obj}')
+        result = emitter(self, obj)
+        if type(result) is GeneratorType:
+            result = yield result
+        return result
 
-            if obj.false_case is not None:
-                self._emit_jump(end_label)
-                self._emit_label(false_label)
-                self._emit(obj.false_case)
+    @_stmt_emitters.register(Value, Immediate, Use, Operator)
+    def _emit_expr_stmt(self, obj):
+        return self._emit_expr(obj)
 
-            self._emit_label(end_label)
+    @_stmt_emitters.register(list)
+    def _emit_stmt_list(self, obj):
+        for o in obj:
+            yield self._emit_stmt(o)
 
-        elif isinstance(obj, While):
-            test_label = self._gen_label()
-            body_label = self._gen_label()
+    @_stmt_emitters.register(Conditional)
+    def _emit_conditional(self, obj):
+        true_label = self._gen_label()
+        if obj.false_case is not None:
+            false_label = self._gen_label()
             end_label = self._gen_label()
-            self._break_to_labels.append(end_label)
-
-            self._emit_label(test_label)
-            cond_result = self._emit(obj.condition)
-            self._emit_conditional_branch(cond_result, body_label, end_label)
-            self._emit_label(body_label)
-            self._emit(obj.body)
-            self._emit_jump(test_label)
-            self._emit_label(end_label)
-
-        elif isinstance(obj, Switch):
-            value = self._emit(obj.value)
-
-            default_case_index = None
-            case_test_labels = []
-            for i, case in enumerate(obj.cases):
-                if case.value is not None:
-                    case_test_labels.append(self._gen_label())
-                else:
-                    default_case_index = i
-            if default_case_index is not None:
-                case_test_labels.append(self._gen_label())
-
-            case_body_labels = [self._gen_label() for _ in obj.cases]
-
+        else:
             end_label = self._gen_label()
-            self._break_to_labels.append(end_label)
-
-            for i, case in enumerate(obj.cases):
-                if i > 0:
-                    self._emit_label(case_test_labels[i])
-                if i == default_case_index:
-                    continue
-                next_test_label = case_test_labels[i + 1] if i + 1 < len(case_test_labels) else end_label
-                case_value = self._emit(case.value)
-                test_result = self._emit(NotEqual(value, case_value))
-                self._emit_conditional_branch(test_result, next_test_label, case_body_labels[i])
-
-            if default_case_index is not None:
-                self._emit_jump(case_body_labels[default_case_index])
-
-            for i, case in enumerate(obj.cases):
-                self._emit_label(case_body_labels[i])
-                self._emit(case.stmts)
-
-            self._emit_label(end_label)
-
-        elif isinstance(obj, Break):
-            assert len(self._break_to_labels) > 0
-            self._emit_jump(self._break_to_labels[-1])
-
-        elif isinstance(obj, Input):
-            v = obj.variable
-            result = Value(v.name, v.type_class)
-            self._add_instr([Input, result])
+            false_label = end_label
+
+        self._emit_condition(obj.condition, true_label, false_label)
+        self._emit_label(true_label)
+        yield self._emit_stmt(obj.true_case)
+
+        if obj.false_case is not None:
+            self._emit_jump(end_label)
+            self._emit_label(false_label)
+            yield self._emit_stmt(obj.false_case)
+
+        self._emit_label(end_label)
+
+    @_stmt_emitters.register(While)
+    def _emit_while(self, obj):
+        test_label = self._gen_label()
+        body_label = self._gen_label()
+        end_label = self._gen_label()
+
+        self._emit_label(test_label)
+        self._emit_condition(obj.condition, body_label, end_label)
+        self._emit_label(body_label)
+        self._break_to_labels.append(end_label)
+        yield self._emit_stmt(obj.body)
+        self._break_to_labels.pop()
+        self._emit_jump(test_label)
+        self._emit_label(end_label)
+
+    @_stmt_emitters.register(Switch)
+    def _emit_switch(self, obj):
+        value = self._emit_expr(obj.value)
+
+        case_body_labels = [self._gen_label() for _ in obj.cases]
+        end_label = self._gen_label()
+        default_label = end_label
+
+        # The first case of each value is the one that is selected
+        case_labels = {}
+        for case, body_label in zip(obj.cases, case_body_labels):
+            if case.value is None:
+                default_label = body_label
+            elif case.value.value not in case_labels:
+                case_labels[case.value.value] = body_label
+        cases = [(Immediate(case_value), body_label) for case_value, body_label in case_labels.items()]
+        self._emit_switch_dispatch(value, cases, default_label)
+
+        # Bodies are laid out in source order, so that they fall through
+        self._break_to_labels.append(end_label)
+        for case, body_label in zip(obj.cases, case_body_labels):
+            self._emit_label(body_label)
+            yield self._emit_stmt(case.stmts)
+        self._break_to_labels.pop()
 
-        elif isinstance(obj, Output):
-            result = self._emit(obj.expr)
-            self._add_instr([Output, result])
+        self._emit_label(end_label)
 
-        elif isinstance(obj, Halt):
-            self._add_instr([Halt])
+    @_stmt_emitters.register(Break)
+    def _emit_break(self, obj):
+        assert len(self._break_to_labels) > 0
+        self._emit_jump(self._break_to_labels[-1])
 
-        else:
-            raise self.Error(f'Missing implemenation for generation of {obj}')
+    @_stmt_emitters.register(Input)
+    def _emit_input(self, obj):
+        v = obj.variable
+        result = Value(v.name, v.type_class)
+        self._add_instr([Input, result])
+        return result
 
+    @_stmt_emitters.register(Output)
+    def _emit_output(self, obj):
+        result = self._emit_expr(obj.expr)
+        self._add_instr([Output, result])
         return result
+
+    @_stmt_emitters.register(Halt)
+    def _emit_halt(self, obj):
+        self._add_instr([Halt])
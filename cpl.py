@@ -1,26 +1,314 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import os
+import sys
+import time
 
 import utils
+from astfile import ASTFile
+from cache import CompileCache
+from instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from lexer import Lexer
 from parser import Parser
+from optimizer import fold_constants
 from codegen import CodeGenerator
 
 
+BACKEND_NAME = 'quad'
+
+# Inputs with this suffix are ASTs saved by --emit-ast rather than source code
+AST_SUFFIX = '.cplast'
+
+COMPILE_ERRORS = (
+    OSError,
+    ASTFile.Error,
+    Lexer.Error,
+    Parser.SyntaxError,
+    Parser.SemanticError,
+    CodeGenerator.Error,
+)
+
+
+def compile_file(input_path, source=None, track_memory=None):
+    # Runs in worker processes as well, so the generated code and the collected
+    # instrumentation (if enabled with track_memory not None) are returned
+    instrumentation = NULL_INSTRUMENTATION
+    if track_memory is not None:
+        instrumentation = Instrumentation(track_memory)
+
+    output = io.StringIO()
+    if source is not None:
+        input_file = io.StringIO(source)
+        input_file.name = input_path
+        compile_stream(input_file, output, instrumentation)
+    else:
+        compile_path(input_path, output, instrumentation)
+
+    return output.getvalue(), instrumentation if instrumentation.enabled else None
+
+
+def compile_path(input_path, output_file, instrumentation=NULL_INSTRUMENTATION):
+    if input_path.endswith(AST_SUFFIX):
+        with open(input_path, 'rb') as input_file:
+            compile_ast(input_file, output_file, instrumentation)
+    else:
+        with utils.smart_open(input_path, 'r') as input_file:
+            compile_stream(input_file, output_file, instrumentation)
+
+
+def compile_stream(input_file, output_file, instrumentation=NULL_INSTRUMENTATION):
+    parser = Parser(input_file, instrumentation=instrumentation)
+    stmts = parser.parse()
+    generate(stmts, output_file, instrumentation)
+
+
+def compile_ast(input_file, output_file, instrumentation=NULL_INSTRUMENTATION):
+    # The front-end is skipped entirely
+    with instrumentation.phase('load-ast'):
+        stmts, _ = ASTFile.load(input_file)
+    generate(stmts, output_file, instrumentation)
+
+
+def generate(stmts, output_file, instrumentation=NULL_INSTRUMENTATION):
+    with instrumentation.phase('fold-constants'):
+        folded = fold_constants(stmts)
+    instrumentation.count('folded-constants', folded)
+
+    code_gen = CodeGenerator(BACKEND_NAME, instrumentation)
+    code_gen.gen(stmts, output_file)
+
+
+def emit_ast(input_path, output_path, instrumentation=NULL_INSTRUMENTATION):
+    with utils.smart_open(input_path, 'r') as input_file:
+        parser = Parser(input_file, instrumentation=instrumentation)
+        stmts = parser.parse()
+
+    with instrumentation.phase('save-ast'), utils.smart_open(output_path, 'wb') as output_file:
+        ASTFile.save(output_file, stmts, parser.variables)
+
+
+def read_source(input_path):
+    with utils.smart_open(input_path, 'r') as input_file:
+        return input_file.read()
+
+
+def compile_files(input_paths, jobs, cache=None, track_memory=None):
+    input_names = ['<stdin>' if path == '-' else path for path in input_paths]
+
+    if cache is None:
+        # Worker processes cannot read our stdin, so it is read up-front
+        sources = [read_source(path) if path == '-' else None for path in input_paths]
+        yield from run_compilations(input_names, sources, jobs, track_memory)
+        return
+
+    # Look up every file first so that only the misses reach the compiler
+    sources = []
+    keys = []
+    outputs = []
+    for input_path in input_paths:
+        try:
+            # Loading an AST is cheap enough, so they bypass the cache
+            source = None if input_path.endswith(AST_SUFFIX) else read_source(input_path)
+        except OSError:
+            # Leave it to compile_file() to report the error in order
+            source = None
+
+        key = None
+        output = None
+        if source is not None:
+            key = cache.key(source.encode(), BACKEND_NAME)
+            output = cache.get(key)
+
+        sources.append(source)
+        keys.append(key)
+        outputs.append(output)
+
+    misses = [i for i, output in enumerate(outputs) if output is None]
+    miss_results = run_compilations([input_names[i] for i in misses],
+                                    [sources[i] for i in misses], jobs, track_memory)
+    with contextlib.closing(miss_results):
+        for key, output in zip(keys, outputs):
+            if output is not None:
+                yield output, None
+                continue
+
+            output, instrumentation = next(miss_results)
+            if key is not None:
+                cache.put(key, output)
+            yield output, instrumentation
+
+
+def run_compilations(input_names, sources, jobs, track_memory=None):
+    track_memory_args = itertools.repeat(track_memory, len(input_names))
+    if jobs == 1 or len(input_names) <= 1:
+        yield from map(compile_file, input_names, sources, track_memory_args)
+        return
+
+    # Results are yielded in input order, regardless of which worker finishes first
+    chunksize = max(1, len(input_names) // (jobs * 4))
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    try:
+        yield from executor.map(compile_file, input_names, sources, track_memory_args,
+                                chunksize=chunksize)
+    finally:
+        # Don't wait for the remaining files when stopping at the first error
+        executor.shutdown(cancel_futures=True)
+
+
+class WatchedFile:
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.source = None
+        self.error = None
+        # Declarations of the last successful parse, see Parser.parse()
+        self.declarations = None
+
+    def poll(self):
+        # Returns the new source if the file's contents changed since the last poll
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self.signature:
+            return None
+
+        self.signature = signature
+        source = read_source(self.path)
+        if source == self.source:
+            return None
+        self.source = source
+        return source
+
+
+def watch(input_paths, output_file, interval, prog):
+    watched_files = [WatchedFile(path) for path in input_paths]
+    while True:
+        for watched in watched_files:
+            try:
+                source = watched.poll()
+                if source is None:
+                    continue
+
+                input_file = io.StringIO(source)
+                input_file.name = watched.path
+                parser = Parser(input_file)
+                stmts = parser.parse(watched.declarations)
+
+                output = io.StringIO()
+                generate(stmts, output)
+
+            except COMPILE_ERRORS as e:
+                message = f'{prog}: error: {watched.path}: {e}'
+                # A file that keeps failing to open is only reported once
+                if message != watched.error:
+                    print(message, file=sys.stderr)
+                watched.error = message
+                if isinstance(e, OSError):
+                    watched.signature = None
+                continue
+
+            reused = watched.declarations is not None and parser.variables is watched.declarations[1]
+            watched.declarations = parser.declarations
+            watched.error = None
+
+            note = ' (declarations reused)' if reused else ''
+            print(f'{prog}: {watched.path}: compiled{note}', file=sys.stderr)
+            output_file.write(output.getvalue())
+            output_file.flush()
+
+        time.sleep(interval)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('input_file', nargs='+', help='Input files')
     parser.add_argument('-o', '--output-file', default='-', help='Output path')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to compile in parallel, 0 uses all CPUs')
+    parser.add_argument('--cache-dir', help='Directory for caching generated code across runs')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='Maximal size of the cache directory in MiB')
+    parser.add_argument('--cache-stats', action='store_true', help='Print cache statistics to stderr')
+    parser.add_argument('--time-passes', action='store_true',
+                        help='Report the time spent in each compiler phase to stderr')
+    parser.add_argument('--mem-passes', action='store_true',
+                        help='Report the peak memory of each compiler phase to stderr, implies --time-passes')
+    parser.add_argument('--passes-format', choices=['table', 'json'], default='table',
+                        help='Format of the --time-passes and --mem-passes report')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Keep running and recompile input files whenever they change')
+    parser.add_argument('--watch-interval', type=float, default=0.5,
+                        help='Seconds between checks for changed files in --watch mode')
+    parser.add_argument('--emit-ast', action='store_true',
+                        help=f'Save the parsed AST of the input file instead of generating code, '
+                             f'a path ending with {AST_SUFFIX} can then be compiled without parsing it again')
     args = parser.parse_args()
 
-    with utils.smart_open(args.output_file, 'w') as output_file:
-        for input_path in args.input_file:
-            with utils.smart_open(input_path, 'r') as input_file:
-                parser = Parser(input_file)
-                stmts = parser.parse()
+    if args.emit_ast and len(args.input_file) != 1:
+        parser.error('--emit-ast takes a single input file')
+
+    if args.watch:
+        if '-' in args.input_file:
+            parser.error('cannot watch stdin')
+        if any(path.endswith(AST_SUFFIX) for path in args.input_file):
+            parser.error(f'cannot watch {AST_SUFFIX} files')
+        with utils.smart_open(args.output_file, 'w') as output_file:
+            try:
+                watch(args.input_file, output_file, args.watch_interval, parser.prog)
+            except KeyboardInterrupt:
+                pass
+        return
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    track_memory = None
+    instrumentation = NULL_INSTRUMENTATION
+    if args.time_passes or args.mem_passes:
+        track_memory = args.mem_passes
+        instrumentation = Instrumentation(track_memory)
+
+    @contextlib.contextmanager
+    def reporting_errors(input_path):
+        try:
+            yield
+        except COMPILE_ERRORS as e:
+            sys.exit(f'{parser.prog}: error: {input_path}: {e}')
+
+    try:
+        if args.emit_ast:
+            with reporting_errors(args.input_file[0]):
+                emit_ast(args.input_file[0], args.output_file, instrumentation)
+            return
 
-                code_gen = CodeGenerator('quad')
-                code_gen.gen(stmts)
+        with utils.smart_open(args.output_file, 'w') as output_file:
+            if jobs == 1 and cache is None:
+                # Nothing to collect, so generate straight into the output file
+                for input_path in args.input_file:
+                    with reporting_errors(input_path):
+                        compile_path(input_path, output_file, instrumentation)
+            else:
+                results = compile_files(args.input_file, jobs, cache, track_memory)
+                with contextlib.closing(results):
+                    for input_path in args.input_file:
+                        with reporting_errors(input_path):
+                            output, file_instrumentation = next(results)
+                        output_file.write(output)
+                        if file_instrumentation is not None:
+                            instrumentation.merge(file_instrumentation)
+    finally:
+        if instrumentation.enabled:
+            instrumentation.report(sys.stderr, args.passes_format)
+        if cache is not None and args.cache_stats:
+            stats = ', '.join(f'{value} {name}' for name, value in cache.stats().items())
+            print(f'{parser.prog}: cache: {stats}', file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+
+class PhaseStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak_bytes = 0
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.peak_bytes = max(self.peak_bytes, other.peak_bytes)
+
+
+class Instrumentation:
+    """
+    Collects the wall time, call count and (optionally) the peak traced
+    memory of compiler phases, along with named counters.
+    """
+
+    enabled = True
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.phases = {}
+        self.counters = {}
+        # [traced memory at entry, highest peak seen so far] of each running phase
+        self._memory_stack = []
+
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        stats = self.phases.setdefault(name, PhaseStats())
+
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._memory_stack:
+                self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._memory_stack.append([current, 0])
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+
+            if self.track_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                # Nested phases reset the peak, so account for theirs as well
+                start_current, nested_peak = self._memory_stack.pop()
+                peak = max(peak, nested_peak)
+                stats.peak_bytes = max(stats.peak_bytes, peak - start_current)
+                if self._memory_stack:
+                    self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        for name, stats in other.phases.items():
+            self.phases.setdefault(name, PhaseStats()).merge(stats)
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def to_json(self):
+        phases = {}
+        for name, stats in self.phases.items():
+            phases[name] = {'calls': stats.calls, 'seconds': stats.seconds}
+            if self.track_memory:
+                phases[name]['peak_bytes'] = stats.peak_bytes
+        return {'phases': phases, 'counters': dict(self.counters)}
+
+    def report(self, output_file, format_name='table'):
+        if format_name == 'json':
+            json.dump(self.to_json(), output_file, indent=2)
+            output_file.write('\n')
+            return
+
+        total_seconds = sum(stats.seconds for stats in self.phases.values())
+        header = f'{"Phase":<28} {"Calls":>7} {"Wall (s)":>10} {"%":>6}'
+        if self.track_memory:
+            header += f' {"Peak (KiB)":>11}'
+        lines = [header, '-' * len(header)]
+        for name, stats in self.phases.items():
+            percent = 100 * stats.seconds / total_seconds if total_seconds > 0 else 0
+            line = f'{name:<28} {stats.calls:>7} {stats.seconds:>10.4f} {percent:>6.1f}'
+            if self.track_memory:
+                line += f' {stats.peak_bytes / 1024:>11.1f}'
+            lines.append(line)
+
+        lines += ['', f'{"Counter":<28} {"Value":>7}', '-' * 36]
+        for name, value in self.counters.items():
+            lines.append(f'{name:<28} {value:>7}')
+        output_file.write('\n'.join(lines) + '\n')
+
+
+class NullInstrumentation:
+    """Stands in for Instrumentation when it is disabled, at no cost."""
+
+    enabled = False
+
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
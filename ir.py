@@ -1,60 +1,96 @@
+import weakref
+
+
 class Type:
     pass
 
 class Integer(Type):
+    ZERO = 0
+
     def __str__(self):
         return 'int'
 
 class Float(Type):
+    ZERO = 0.0
+
     def __str__(self):
         return 'float'
 
 class Variable:
+    __slots__ = ('name', 'type_class', 'use')
+
     def __init__(self, name, type_class):
         self.name = name
         self.type_class = type_class
+        # The single Use of this variable, see Use.__new__()
+        self.use = None
+
+    def __reduce__(self):
+        return (Variable, (self.name, self.type_class))
 
     def __str__(self):
         return f'<{self.name}:{self.type_class}>'
 
 class Statement:
-    pass
+    __slots__ = ()
 
 class Break(Statement):
-    pass
+    __slots__ = ()
 
 class While(Statement):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
 
 class Case:
+    __slots__ = ('stmts', 'value')
+
     def __init__(self, stmts, value):
         self.stmts = stmts
         self.value = value
 
 class Switch(Statement):
+    __slots__ = ('value', 'cases')
+
     def __init__(self, value, cases):
         self.value = value
         self.cases = cases
 
 class Conditional(Statement):
+    __slots__ = ('condition', 'true_case', 'false_case')
+
     def __init__(self, condition, true_case, false_case=None):
         self.condition = condition
         self.true_case = true_case
         self.false_case = false_case
 
 class Input(Statement):
+    __slots__ = ('variable',)
+
     def __init__(self, variable):
         self.variable = variable
 
 class Output(Statement):
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
         self.expr = expr
 
 class Use:
-    def __init__(self, variable):
-        self.variable = variable
+    # Leaves are immutable and interned, so equal leaves are the same object
+    __slots__ = ('variable',)
+
+    def __new__(cls, variable):
+        use = variable.use
+        if use is None:
+            use = variable.use = super().__new__(cls)
+            use.variable = variable
+        return use
+
+    def __getnewargs__(self):
+        return (self.variable,)
 
     def get_type(self):
         return self.variable.type_class
@@ -63,46 +99,80 @@ class Use:
         return str(self.variable)
 
 class Immediate:
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value', '_type', '__weakref__')
+
+    TYPES = {int: Integer, float: Float}
+
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, value):
+        # 0.0 and -0.0 are equal but print differently, so zeros are keyed by text
+        key = (type(value), value if value != 0 else str(value))
+        immediate = cls._interned.get(key)
+        if immediate is None:
+            type_class = cls.TYPES.get(type(value))
+            if type_class is None:
+                raise Operator.TypeError(f'{value!r} is neither an int nor a float')
+            immediate = super().__new__(cls)
+            immediate.value = value
+            immediate._type = type_class
+            cls._interned[key] = immediate
+        return immediate
+
+    def __getnewargs__(self):
+        return (self.value,)
 
     def get_type(self):
-        if type(self.value) is int:
-            return Integer
-        if type(self.value) is float:
-            return Float
-        assert False, 'INTERNAL ERROR'
+        return self._type
 
     def __str__(self):
         return str(self.value)
 
 class Operator:
+    __slots__ = ('operands', '_type')
+
+    class TypeError(Exception):
+        pass
+
+    # The type of the result, or None for the type of the operands
+    RESULT_TYPE = None
+
     def __init__(self, *args):
-        self.operands = list(args)
+        self.operands = args
+
+        # Types are checked and stored once, so get_type() is a field read
+        operand_type = args[0].get_type()
+        for op in args[1:]:
+            if op.get_type() is not operand_type:
+                self._raise_type_error(args)
+        self._type = self.RESULT_TYPE or operand_type
 
     def get_type(self):
-        t = self.operands[0].get_type()
-        for op in self.operands[1:]:
-            assert t == op.get_type()
-        return t
+        return self._type
 
-class UnaryOperator(Operator):
-    pass
+    def _raise_type_error(self, operands):
+        types = ', '.join(op.get_type().__name__ for op in operands)
+        raise Operator.TypeError(f'{type(self).__name__} of mismatching types ({types})')
 
 class UnaryOperator(Operator):
+    __slots__ = ()
+
     def __init__(self, a):
-        super().__init__(a)
+        # Same as Operator.__init__(), without the generic argument handling
+        self.operands = (a,)
+        self._type = self.RESULT_TYPE or a.get_type()
 
 class StaticCast(UnaryOperator):
+    __slots__ = ('dest_type',)
+
     def __init__(self, a, dest_type):
         super().__init__(a)
-        self.dest_type = dest_type
-
-    def get_type(self):
-        return self.dest_type
+        if dest_type is not Integer and dest_type is not Float:
+            raise Operator.TypeError(f'Cannot cast to {dest_type}')
+        self.dest_type = self._type = dest_type
 
-    @staticmethod
-    def compute(a):
+    def compute(self, a):
+        # RTOI truncates towards zero
         if self.dest_type == Integer:
             return int(a)
         if self.dest_type == Float:
@@ -110,108 +180,215 @@ class StaticCast(UnaryOperator):
         assert False, 'INTERNAL ERROR'
 
 class UnaryAdd(UnaryOperator):
+    __slots__ = ()
+
+    # Quad computes 0 + a, which turns a float -0.0 into 0.0
     @staticmethod
     def compute(a):
-        return a
+        return 0 + a
 
 class Negate(UnaryOperator):
+    __slots__ = ()
+
+    # Quad computes 0 - a, which turns a float 0.0 into 0.0 rather than -0.0
     @staticmethod
     def compute(a):
-        return -a
+        return 0 - a
 
 class Not(UnaryOperator):
+    __slots__ = ()
+
+    RESULT_TYPE = Integer
+
     @staticmethod
     def compute(a):
-        return not a
-
-    def get_type(self):
-        return Integer
+        return int(a == 0)
 
 class BinaryOperator(Operator):
+    __slots__ = ()
+
     def __init__(self, a, b):
-        super().__init__(a, b)
+        # Same as Operator.__init__(), without the generic argument handling
+        self.operands = (a, b)
+        operand_type = a.get_type()
+        if b.get_type() is not operand_type:
+            self._raise_type_error(self.operands)
+        self._type = self.RESULT_TYPE or operand_type
 
 class Assign(BinaryOperator):
-    pass
+    __slots__ = ()
+
+    def __init__(self, a, b):
+        if type(a) is not Use:
+            raise Operator.TypeError('Only a variable can be assigned to')
+        super().__init__(a, b)
 
 class Add(BinaryOperator):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
         return a + b
 
 class Sub(BinaryOperator):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
         return a - b
 
 class Mul(BinaryOperator):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
         return a * b
 
 class Div(BinaryOperator):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
+        # Integer division truncates towards zero, as in Quad
+        if type(a) is int:
+            quotient = abs(a) // abs(b)
+            return quotient if (a < 0) == (b < 0) else -quotient
         return a / b
 
 class Or(BinaryOperator):
+    __slots__ = ()
+
+    RESULT_TYPE = Integer
+
     @staticmethod
     def compute(a, b):
-        return a or b
-
-    def get_type(self):
-        return Integer
+        return int(a != 0 or b != 0)
 
 class And(BinaryOperator):
+    __slots__ = ()
+
+    RESULT_TYPE = Integer
+
     @staticmethod
     def compute(a, b):
-        return a and b
-
-    def get_type(self):
-        return Integer
+        return int(a != 0 and b != 0)
 
 class Compare(BinaryOperator):
-    def get_type(self):
-        return Integer
+    __slots__ = ()
+
+    RESULT_TYPE = Integer
 
 class Equal(Compare):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
-        return a == b
+        return int(a == b)
 
 class NotEqual(Compare):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
-        return a != b
+        return int(a != b)
 
 class Less(Compare):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
-        return a < b
+        return int(a < b)
 
 class Greater(Compare):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
-        return a > b
+        return int(a > b)
 
 class LessOrEqual(Compare):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
-        return a <= b
+        return int(a <= b)
 
 class GreaterOrEqual(Compare):
+    __slots__ = ()
+
     @staticmethod
     def compute(a, b):
-        return a >= b
+        return int(a >= b)
+
+
+class HashConsTable:
+    """
+    Builds operators so that identical pure subtrees share a single node.
+
+    A subtree is pure if it contains no Assign. Since leaves are interned,
+    two pure operators are identical iff their classes and operands are.
+    """
+
+    __slots__ = ('_nodes', '_shared')
+
+    def __init__(self):
+        self._nodes = {}
+        self._shared = set()
+
+    def make(self, op_class, *args):
+        # args are the operands, followed by the destination type of a StaticCast
+        node = None
+        if op_class is not Assign:
+            key = (op_class,) + args
+            node = self._nodes.get(key)
+            if node is not None:
+                return node
+
+        node = op_class(*args)
+        if op_class is not Assign and all(self.is_pure(arg) for arg in node.operands):
+            self._nodes[key] = node
+            self._shared.add(node)
+        return node
+
+    def is_pure(self, node):
+        return type(node) is Use or type(node) is Immediate or node in self._shared
+
+
+# Iteration
+
+def walk(obj):
+    """Yields every node of an AST, without recursing in Python."""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if obj is None:
+            continue
+        if isinstance(obj, list):
+            stack.extend(reversed(obj))
+            continue
+
+        yield obj
+        if isinstance(obj, Operator):
+            stack.extend(reversed(obj.operands))
+        elif isinstance(obj, While):
+            stack += [obj.body, obj.condition]
+        elif isinstance(obj, Switch):
+            stack += [obj.cases, obj.value]
+        elif isinstance(obj, Case):
+            stack += [obj.stmts, obj.value]
+        elif isinstance(obj, Conditional):
+            stack += [obj.false_case, obj.true_case, obj.condition]
+        elif isinstance(obj, Output):
+            stack.append(obj.expr)
 
 
 # CodeGen statements
 
 class Halt(Statement):
-    pass
+    __slots__ = ()
 
 class Jump(Statement):
-    pass
+    __slots__ = ()
 
 class CondBr(Statement):
-    pass
+    __slots__ = ()
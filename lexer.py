@@ -1,3 +1,5 @@
+import re
+
 from tokens import *
 
 
@@ -53,119 +55,174 @@ class Lexer:
 
     SYMBOLS_BY_PREFIX = build_prefixes_list(SYMBOLS.keys())
 
+    IDENTIFIER_RE = re.compile(r'[^\W\d]\w*')
+    NUMBER_RE = re.compile(r'\d+(\.\d*)?')
+    SPACES_RE = re.compile(r'\s*')
+    COMMENT_END = '*/'
+
+    # Sources are read in large chunks into memory and then scanned by index
+    READ_CHUNK_SIZE = 1 << 16
+
     def __init__(self, stream):
         self.stream = stream
-        self.eof = False
-        self.line = 1
-        self.column = 1
-        self._c = ' '
+        self.text = self._read_source(stream)
+        self.source = SourceFile(stream.name, self.text)
+        self.pos = 0
+        self.eof = len(self.text) == 0
 
     def tokens(self):
-        # Yield a dummy token to pipe initial source location
-        yield Token(Token.COMMENT, SourceLocation(self.stream.name, 1, 1))
-
-        while not self.eof:
-            token = self.next_token()
-            if token is None:
-                break
-            yield token
+        stream = TokenStream()
+        file_id = stream.add_file(self.source)
+        stream.extend(file_id, iter(self._next, None))
+        return stream
 
     def next_token(self):
+        token = self._next()
+        if token is None:
+            return None
+        kind, start, data = token
+        return Token(kind, self.location(start), data)
+
+    def _next(self):
+        # Returns the next (kind, offset, data) triple without allocating a Token
         kind = None
         data = None
+        text = self.text
 
         # Skip spaces
-        while self._c.isspace():
-            self._c = self._read_char()
+        pos = self.pos
+        if pos < len(text) and text[pos].isspace():
+            pos = self.SPACES_RE.match(text, pos).end()
+        if pos == len(text):
+            self.pos = pos
+            self.eof = True
+            return None
 
         # Remember start of token
-        line, column = self.line, self.column
+        start = pos
+        c = text[pos]
 
         # Handle keywords and identifiers
-        if self._c == '_' or self._c.isalpha():
-            identifier = self._c
-            while True:
-                self._c = self._read_char()
-                if self._c != '_' and not self._c.isalnum():
-                    break
-                identifier += self._c
+        if c == '_' or c.isalpha():
+            pos = self.IDENTIFIER_RE.match(text, pos).end()
+            identifier = text[start:pos]
 
             kind = self.KEYWORDS.get(identifier, Token.IDENTIFIER)
             data = identifier if kind == Token.IDENTIFIER else None
 
         # Handle numbers
-        elif self._c.isdigit():
-            is_float = False
-            num_str = self._c
-            while True:
-                self._c = self._read_char()
-                if not self._c.isdigit():
-                    break
-                num_str += self._c
-            if self._c == '.':
-                is_float = True
-                num_str += self._c
-
-                while True:
-                    self._c = self._read_char()
-                    if not self._c.isdigit():
-                        break
-                    num_str += self._c
+        elif c.isdigit():
+            match = self.NUMBER_RE.match(text, pos)
+            pos = match.end()
+            num_str = match.group()
 
             kind = Token.NUMBER
-            data = float(num_str) if is_float else int(num_str)
+            data = float(num_str) if match.group(1) is not None else int(num_str)
 
         # Handle operators and comments
-        elif self._c in self.SYMBOLS_BY_PREFIX[1]:
-            best_token = None
-            op = ''
-
-            for i in range(1, len(self.SYMBOLS_BY_PREFIX)):
-                if op + self._c not in self.SYMBOLS_BY_PREFIX[i]:
+        elif c in self.SYMBOLS_BY_PREFIX[1]:
+            # Longest match
+            for length in range(len(self.SYMBOLS_BY_PREFIX) - 1, 0, -1):
+                op = text[start:start + length]
+                kind = self.SYMBOLS.get(op)
+                if kind is not None:
+                    pos = start + len(op)
                     break
-                op += self._c
-                self._c = self._read_char()
-
-                best_token = self.SYMBOLS.get(op, best_token)
 
-            kind = self.SYMBOLS[op]
             if kind == Token.COMMENT:
-                COMMENT_END = '*/'
+                comment_end = text.find(self.COMMENT_END, pos)
+                if comment_end < 0:
+                    self._raise_error('Expected comment to end before EOF', len(text))
 
-                comment_text = ''
-                candidate = len(COMMENT_END) * ' '
-                while True:
-                    self._c = self._read_char()
-                    if len(self._c) == 0:
-                        self._raise_error('Expected comment to end before EOF')
+                data = text[pos:comment_end]
+                pos = comment_end + len(self.COMMENT_END)
 
-                    comment_text += self._c
-                    candidate = candidate[-1:] + self._c
-                    if candidate == COMMENT_END:
-                        break
+        if kind is None:
+            self._raise_error(f'Did not expect \'{c}\'', start)
 
-                # Must always contain the next character after matching
-                self._c = self._read_char()
+        self.pos = pos
+        self.eof = pos == len(text)
+        return kind, start, data
 
-                comment_text = comment_text[:-len(COMMENT_END)]
-                data = comment_text
+    def location(self, offset):
+        return self.source.location(offset)
 
-        if kind is None:
-            if self.eof:
+    @classmethod
+    def _read_source(cls, stream):
+        chunks = []
+        while True:
+            chunk = stream.read(cls.READ_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def _raise_error(self, msg, offset):
+        raise self.Error(f'{msg} in {self.location(offset)}')
+
+
+class RegexLexer(Lexer):
+    """
+    Alternative lexer engine that compiles KEYWORDS and SYMBOLS into a single
+    master regex at import time and emits tokens from it.
+    """
+
+    def build_master_regex(keywords, symbols):
+        # Each alternative is a single capturing group so that a match's
+        # lastindex directly indexes the table of token kinds.
+        alternatives = []
+        group_kinds = [None]
+
+        for keyword, kind in keywords.items():
+            alternatives.append(re.escape(keyword) + r'(?!\w)')
+            group_kinds.append(kind)
+
+        alternatives.append(r'[^\W\d]\w*')
+        group_kinds.append(Token.IDENTIFIER)
+        alternatives.append(r'\d+(?:\.\d*)?')
+        group_kinds.append(Token.NUMBER)
+
+        # Longer symbols come first so that the alternation is a longest match
+        for symbol in sorted(symbols, key=len, reverse=True):
+            alternatives.append(re.escape(symbol))
+            group_kinds.append(symbols[symbol])
+
+        pattern = r'\s*(?:' + '|'.join(f'({alt})' for alt in alternatives) + ')?'
+        return re.compile(pattern), group_kinds
+
+    MASTER_RE, GROUP_KINDS = build_master_regex(Lexer.KEYWORDS, Lexer.SYMBOLS)
+
+    def _next(self):
+        text = self.text
+        match = self.MASTER_RE.match(text, self.pos)
+        group = match.lastindex
+
+        if group is None:
+            pos = match.end()
+            self.pos = pos
+            if pos == len(text):
+                self.eof = True
                 return None
-            self._raise_error(f'Did not expect \'{self._c}\'')
-
-        return Token(kind, SourceLocation(self.stream.name, line, column), data)
+            self._raise_error(f'Did not expect \'{text[pos]}\'', pos)
 
-    def _read_char(self):
-        c = self.stream.read(1)
-        self.column += 1
-        if len(c) == 0:
-            self.eof = True
-        elif c == '\n':
-            self.line += 1
-            self.column = 1
-        return c
+        start = match.start(group)
+        pos = match.end()
+        kind = self.GROUP_KINDS[group]
+        data = None
 
-    def _raise_error(self, msg):
-        raise self.Error(f'{msg} in {self.stream.name}:{self.line}:{self.column}')
+        if kind == Token.IDENTIFIER:
+            data = match.group(group)
+        elif kind == Token.NUMBER:
+            num_str = match.group(group)
+            data = float(num_str) if '.' in num_str else int(num_str)
+        elif kind == Token.COMMENT:
+            comment_end = text.find(self.COMMENT_END, pos)
+            if comment_end < 0:
+                self._raise_error('Expected comment to end before EOF', len(text))
+
+            data = text[pos:comment_end]
+            pos = comment_end + len(self.COMMENT_END)
+
+        self.pos = pos
+        self.eof = pos == len(text)
+        return kind, start, data
@@ -0,0 +1,84 @@
+import math
+
+from ir import *
+
+
+def fold_constants(stmts):
+    """
+    Replaces every operator whose operands are all immediates with the
+    immediate it evaluates to, following Quad's int/float semantics.
+    Statements are updated in place; returns the number of folded operators.
+    """
+    folded = 0
+    stack = []
+
+    def visit(obj):
+        # Folds an expression in statement position, or schedules a statement
+        nonlocal folded
+        if isinstance(obj, Operator):
+            obj, count = fold_expr(obj)
+            folded += count
+        elif obj is not None:
+            stack.append(obj)
+        return obj
+
+    visit(stmts)
+    while len(stack) > 0:
+        obj = stack.pop()
+        if isinstance(obj, list):
+            for i, o in enumerate(obj):
+                obj[i] = visit(o)
+        elif isinstance(obj, Conditional):
+            obj.condition = visit(obj.condition)
+            obj.true_case = visit(obj.true_case)
+            obj.false_case = visit(obj.false_case)
+        elif isinstance(obj, While):
+            obj.condition = visit(obj.condition)
+            obj.body = visit(obj.body)
+        elif isinstance(obj, Switch):
+            obj.value = visit(obj.value)
+            for case in obj.cases:
+                case.stmts = visit(case.stmts)
+        elif isinstance(obj, Output):
+            obj.expr = visit(obj.expr)
+
+    return folded
+
+
+def fold_expr(expr):
+    """Returns the folded expression and the number of folded operators."""
+    # Operators in reverse pre-order come after all of their operands
+    operators = []
+    stack = [expr]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, Operator):
+            operators.append(node)
+            stack.extend(node.operands)
+
+    immediates = {}
+    for node in reversed(operators):
+        operands = node.operands
+        if any(id(op) in immediates for op in operands):
+            operands = node.operands = tuple(immediates.get(id(op), op) for op in operands)
+
+        if isinstance(node, Assign) or not all(isinstance(op, Immediate) for op in operands):
+            continue
+        value = evaluate(node, [op.value for op in operands])
+        if value is not None:
+            immediates[id(node)] = Immediate(value)
+
+    return immediates.get(id(expr), expr), len(immediates)
+
+
+def evaluate(operator, values):
+    # Returns None for results that must be left to run-time
+    try:
+        value = operator.compute(*values)
+    except (ZeroDivisionError, OverflowError, ValueError):
+        # Division by zero, ints too large for a float, and infinite or NaN floats cast to int
+        return None
+    if type(value) is float and not math.isfinite(value):
+        return None
+    assert Immediate(value).get_type() is operator.get_type()
+    return value
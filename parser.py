@@ -1,6 +1,9 @@
+import utils
 from lexer import Lexer
 from tokens import Token
 from ir import *
+from optimizer import evaluate
+from instrumentation import NULL_INSTRUMENTATION
 
 
 class Parser:
@@ -16,19 +19,75 @@ class Parser:
         Token.FLOAT: Float,
     }
 
-    def __init__(self, stream):
-        self._lexer = Lexer(stream)
-        self._last_accepted_token = None
-        self._current_token = None
+    # Binary operators by token, with their binding power (higher binds tighter)
+    BINARY_OPS = {
+        Token.ASSIGN: (1, Assign),
+        Token.OR: (2, Or),
+        Token.AND: (3, And),
+        Token.EQUAL: (4, Equal),
+        Token.NEQUAL: (4, NotEqual),
+        Token.LESS: (5, Less),
+        Token.GREATER: (5, Greater),
+        Token.EQLESS: (5, LessOrEqual),
+        Token.EQGREATER: (5, GreaterOrEqual),
+        Token.PLUS: (6, Add),
+        Token.MINUS: (6, Sub),
+        Token.MULTIPLY: (7, Mul),
+        Token.DIVIDE: (7, Div),
+    }
+    RIGHT_ASSOCIATIVE_OPS = {Assign}
+
+    # Unary operators bind tighter than any binary operator
+    UNARY_OPS = {
+        Token.PLUS: UnaryAdd,
+        Token.MINUS: Negate,
+        Token.NOT: Not,
+    }
+    UNARY_BINDING_POWER = 8
+
+    def __init__(self, stream, lexer_class=Lexer, instrumentation=NULL_INSTRUMENTATION, hash_cons=False):
+        self._lexer = lexer_class(stream)
+        self._instrumentation = instrumentation
+        # Shares identical pure subexpressions between expressions if enabled
+        self._node_table = HashConsTable() if hash_cons else None
+        self._tokens = None
+        self._index = -1
+        self._last_accepted_index = None
         self._breakable_scopes_depth = 0
+        # (source text of the declarations, variables), reusable by a later parse
+        self.declarations = None
+
+    def parse(self, declarations=None):
+        variables = None
+        if declarations is not None:
+            # Declarations are reused if the source still begins with the exact
+            # same text, followed directly by the statement block
+            declarations_text, previous_variables = declarations
+            text = self._lexer.text
+            if text.startswith(declarations_text) and text.startswith('{', len(declarations_text)):
+                self._lexer.pos = len(declarations_text)
+                variables = previous_variables
+
+        with self._instrumentation.phase('lex'):
+            self._tokens = self._lexer.tokens()
+
+        with self._instrumentation.phase('parse'):
+            self._advance()
+            stmts = self._parse_program(variables)
 
-    def parse(self):
-        self._advance()
-        return self._parse_program()
+        if self._instrumentation.enabled:
+            self._instrumentation.count('tokens', len(self._tokens))
+            self._instrumentation.count('ast-nodes', sum(1 for _ in walk(stmts)))
+        return stmts
+
+    def _parse_program(self, variables=None):
+        self.variables = variables if variables is not None else self._parse_declarations()
 
-    def _parse_program(self):
-        self.variables = self._parse_declarations()
-        return self._parse_stmt_block()
+        if self._index < len(self._tokens):
+            declarations_end = self._tokens.offsets[self._index]
+            self.declarations = (self._lexer.text[:declarations_end], self.variables)
+
+        return utils.trampoline(self._parse_stmt_block())
 
     def _parse_declarations(self):
         variables = {}
@@ -49,31 +108,34 @@ class Parser:
         for token, type_class in self.TYPES.items():
             if self._accept(token):
                 return type_class
-        self._expected('Expected a type')
+        self.raise_error(self.SyntaxError, 'Expected a type')
 
     def _parse_id_list(self):
         idents = []
         while True:
-            variable = self._accept(Token.IDENTIFIER)
-            if variable is None:
+            if not self._accept(Token.IDENTIFIER):
                 return idents
 
-            idents.append(variable.data)
+            idents.append(self._last_accepted_data())
             while self._accept(Token.COMMA):
-                variable = self._expect(Token.IDENTIFIER)
-                idents.append(variable.data)
+                self._expect(Token.IDENTIFIER)
+                idents.append(self._last_accepted_data())
         return idents
 
+    # Statements are parsed by generators run through utils.trampoline(), where
+    # "yield self._parse_stmt()" stands for a recursive call. This keeps deeply
+    # nested statements from exhausting the Python stack.
+
     def _parse_stmt_block(self):
         self._expect(Token.LBRACE)
-        stmts = self._parse_stmt_list()
+        stmts = yield self._parse_stmt_list()
         self._expect(Token.RBRACE)
         return stmts
 
     def _parse_stmt_list(self):
         stmts = []
         while True:
-            stmt = self._parse_stmt()
+            stmt = yield self._parse_stmt()
             if stmt is None:
                 break
             stmts.append(stmt)
@@ -84,17 +146,18 @@ class Parser:
             self._expect(Token.LPAREN)
             condition = self._parse_expr()
             self._expect(Token.RPAREN)
-            true_case = self._parse_stmt()
+            true_case = yield self._parse_stmt()
 
             false_case = None
             if self._accept(Token.ELSE):
-                false_case = self._parse_stmt()
+                false_case = yield self._parse_stmt()
 
             return Conditional(condition, true_case, false_case)
 
         elif self._accept(Token.INPUT):
             self._expect(Token.LPAREN)
-            ident = self._expect(Token.IDENTIFIER).data
+            self._expect(Token.IDENTIFIER)
+            ident = self._last_accepted_data()
             self._expect(Token.RPAREN)
             self._expect(Token.SEMICOLON)
 
@@ -117,7 +180,7 @@ class Parser:
             self._expect(Token.RPAREN)
 
             self._breakable_scopes_depth += 1
-            body = self._parse_stmt()
+            body = yield self._parse_stmt()
             self._breakable_scopes_depth -= 1
 
             return While(condition, body)
@@ -133,7 +196,7 @@ class Parser:
             has_default_case = False
 
             while self._accept(Token.CASE) or self._accept(Token.DEFAULT):
-                parsing_case = self._last_accepted_token.kind == Token.CASE
+                parsing_case = self._tokens.kinds[self._last_accepted_index] == Token.CASE
                 if parsing_case:
                     case_expr = self._parse_expr()
                     case_expr = Immediate(self.eval_const_expr(case_expr))
@@ -148,7 +211,7 @@ class Parser:
                 self._expect(Token.COLON)
 
                 self._breakable_scopes_depth += 1
-                case_body = self._parse_stmt_list()
+                case_body = yield self._parse_stmt_list()
                 self._breakable_scopes_depth -= 1
 
                 cases.append(Case(case_body, case_expr))
@@ -165,7 +228,7 @@ class Parser:
             return Break()
 
         elif self._accept(Token.LBRACE):
-            stmts = self._parse_stmt_list()
+            stmts = yield self._parse_stmt_list()
             self._expect(Token.RBRACE)
 
             return stmts
@@ -178,133 +241,173 @@ class Parser:
 
             return expr
 
-    def _parse_expr(self, precedence=0):
-        expr = self._try_parse_expr(precedence)
+    def _parse_expr(self):
+        expr = self._try_parse_expr()
         if expr is None:
             self.raise_error(self.SyntaxError, 'Expected an expression')
         return expr
 
-    def _try_parse_expr(self, precedence=0):
-        right_associative_ops = [Assign]
-        ops = [
-            [(Token.ASSIGN, Assign)],
-            [(Token.OR, Or), ],
-            [(Token.AND, And), ],
-            [(Token.EQUAL, Equal), (Token.NEQUAL, NotEqual), ],
-            [(Token.LESS, Less), (Token.GREATER, Greater),
-             (Token.EQLESS, LessOrEqual), (Token.EQGREATER, GreaterOrEqual), ],
-            [(Token.PLUS, Add), (Token.MINUS, Sub), ],
-            [(Token.MULTIPLY, Mul), (Token.DIVIDE, Div), ],
-
-            [(Token.PLUS, UnaryAdd),
-             (Token.MINUS, Negate),
-             (Token.NOT, Not), ]
-        ]
-
-        if precedence >= len(ops):
-            return self._try_parse_factor()
-
-        for token, op in ops[precedence]:
-            if not issubclass(op, UnaryOperator):
-                continue
-            if self._accept(token):
-                term = self._try_parse_expr(precedence)
-                return op(term)
-
-        term = self._try_parse_expr(precedence + 1)
-        if term is None:
-            return None
+    def _try_parse_expr(self):
+        # Operator-precedence parsing over explicit stacks, so that the depth of
+        # an expression is not limited by the Python stack. Entries of the
+        # operators stack are (binding power, operator class, arity), or
+        # (None, destination type or None, 0) for an open static_cast or parenthesis.
+        kinds = self._tokens.kinds
+        operands = []
+        operators = []
+        open_groups = 0
 
         while True:
-            found = False
-            for token, op in ops[precedence]:
-                if not issubclass(op, BinaryOperator):
-                    continue
+            # Expecting an operand, possibly preceded by prefix operators and groups
+            kind = kinds[self._index] if self._index < len(kinds) else None
+            unary_op = self.UNARY_OPS.get(kind)
+            if unary_op is not None:
+                self._advance()
+                operators.append((self.UNARY_BINDING_POWER, unary_op, 1))
+                continue
 
-                if self._accept(token):
-                    lhs = term
-                    if op in right_associative_ops:
-                        rhs = self._parse_expr(precedence)
-                    else:
-                        rhs = self._parse_expr(precedence + 1)
-
-                    lhs, rhs = self._create_implicit_casts(lhs, rhs)
-                    term = op(lhs, rhs)
-                    found = True
-            if not found:
-                break
+            if self._accept(Token.LPAREN):
+                operators.append((None, None, 0))
+                open_groups += 1
+                continue
 
-        return term
+            if self._accept(Token.STATIC_CAST):
+                self._expect(Token.LESS)
+                dest_type = self._parse_type()
+                self._expect(Token.GREATER)
+                self._expect(Token.LPAREN)
+                operators.append((None, dest_type, 0))
+                open_groups += 1
+                continue
 
-    def _try_parse_factor(self):
-        if self._accept(Token.LPAREN):
-            factor = self._parse_expr()
-            self._expect(Token.RPAREN)
+            factor = self._try_parse_factor()
+            if factor is None:
+                if len(operators) == 0:
+                    return None
+                self.raise_error(self.SyntaxError, 'Expected an expression')
+            operands.append(factor)
+
+            # Expecting a binary operator, closing parentheses or the end of the expression
+            while True:
+                kind = kinds[self._index] if self._index < len(kinds) else None
+                binary_op = self.BINARY_OPS.get(kind)
+                if binary_op is not None:
+                    break
+
+                if kind == Token.RPAREN and open_groups > 0:
+                    self._reduce(operands, operators, 0)
+                    _, dest_type, _ = operators.pop()
+                    open_groups -= 1
+                    if dest_type is not None:
+                        operands.append(self._make_operator(StaticCast, operands.pop(), dest_type))
+                    self._advance()
+                    continue
 
-        elif self._accept(Token.STATIC_CAST):
-            self._expect(Token.LESS)
-            dest_type = self._parse_type()
-            self._expect(Token.GREATER)
+                if open_groups > 0:
+                    self.raise_error(self.SyntaxError, f'Expected a {Token.kind_to_str(Token.RPAREN)}')
+                self._reduce(operands, operators, 0)
+                return operands.pop()
 
-            self._expect(Token.LPAREN)
-            expr = self._parse_expr()
-            self._expect(Token.RPAREN)
+            binding_power, op = binary_op
+            self._reduce(operands, operators, binding_power, op in self.RIGHT_ASSOCIATIVE_OPS)
+            operators.append((binding_power, op, 2))
+            self._advance()
 
-            factor = StaticCast(expr, dest_type)
+    def _reduce(self, operands, operators, binding_power, right_associative=False):
+        # Applies the stacked operators that bind at least as tight as binding_power
+        while len(operators) > 0:
+            top_binding_power, op, arity = operators[-1]
+            if top_binding_power is None or top_binding_power < binding_power:
+                break
+            if top_binding_power == binding_power and right_associative:
+                break
+            operators.pop()
+
+            if arity == 1:
+                operands.append(self._make_operator(op, operands.pop()))
+            else:
+                rhs = operands.pop()
+                lhs = operands.pop()
+                lhs, rhs = self._create_implicit_casts(op, lhs, rhs)
+                operands.append(self._make_operator(op, lhs, rhs))
 
-        elif self._accept(Token.IDENTIFIER):
-            var_name = self._last_accepted_token.data
+    def _try_parse_factor(self):
+        if self._accept(Token.IDENTIFIER):
+            var_name = self._last_accepted_data()
             if var_name not in self.variables:
                 self.raise_error(self.SemanticError, f'{var_name} is undeclared')
-            factor = Use(self.variables[var_name])
+            return Use(self.variables[var_name])
 
-        elif self._accept(Token.NUMBER):
-            factor = Immediate(self._last_accepted_token.data)
+        if self._accept(Token.NUMBER):
+            return Immediate(self._last_accepted_data())
 
-        else:
-            return None
+        return None
 
-        return factor
-
-    def _create_implicit_casts(self, lhs, rhs):
+    def _create_implicit_casts(self, op, lhs, rhs):
         if lhs.get_type() == rhs.get_type():
             return lhs, rhs
 
         if lhs.get_type() == Integer:
             if op is Assign:
                 self.raise_error(self.SemanticError, 'Cannot assign float value to a variable of type integer')
-            lhs = StaticCast(lhs, Float)
+            lhs = self._make_operator(StaticCast, lhs, Float)
         else:
-            rhs = StaticCast(rhs, Float)
+            rhs = self._make_operator(StaticCast, rhs, Float)
 
         return lhs, rhs
 
+    def _make_operator(self, op_class, *args):
+        try:
+            if self._node_table is None:
+                return op_class(*args)
+            return self._node_table.make(op_class, *args)
+        except Operator.TypeError as e:
+            self.raise_error(self.SemanticError, str(e))
+
     def eval_const_expr(self, expr):
-        if isinstance(expr, Immediate):
-            return expr.value
-        if not isinstance(expr, Operator):
-            self.raise_error(self.SemanticError, f'Could not evaluate {expr} as part of a constant-expression')
-        operands = [self.eval_const_expr(op) for op in expr.operands]
-        return expr.compute(*operands)
+        # Post-order evaluation over an explicit stack
+        values = []
+        stack = [(expr, False)]
+        while len(stack) > 0:
+            expr, operands_done = stack.pop()
+            if isinstance(expr, Immediate):
+                values.append(expr.value)
+            elif not isinstance(expr, Operator):
+                self.raise_error(self.SemanticError, f'Could not evaluate {expr} as part of a constant-expression')
+            elif operands_done:
+                num_operands = len(expr.operands)
+                operands = values[-num_operands:]
+                del values[-num_operands:]
+                value = evaluate(expr, operands)
+                if value is None:
+                    self.raise_error(self.SemanticError, 'Constant-expression has no value at compile-time')
+                values.append(value)
+            else:
+                stack.append((expr, True))
+                stack.extend((op, False) for op in reversed(expr.operands))
+        return values[0]
 
     def _advance(self):
-        self._current_token = self._lexer.next_token()
-        while self._current_token is not None and self._current_token.kind == Token.COMMENT:
-            self._current_token = self._lexer.next_token()
+        kinds = self._tokens.kinds
+        self._index += 1
+        while self._index < len(kinds) and kinds[self._index] == Token.COMMENT:
+            self._index += 1
 
     def _accept(self, token_kind):
-        token = None
-        if self._current_token is not None and self._current_token.kind == token_kind:
-            self._last_accepted_token = self._current_token
-            token = self._current_token
+        kinds = self._tokens.kinds
+        if self._index < len(kinds) and kinds[self._index] == token_kind:
+            self._last_accepted_index = self._index
             self._advance()
-        return token
+            return True
+        return False
 
     def _expect(self, token_kind):
-        token = self._accept(token_kind)
-        if token is None:
+        if not self._accept(token_kind):
             self.raise_error(self.SyntaxError, f'Expected a {Token.kind_to_str(token_kind)}')
-        return token
+
+    def _last_accepted_data(self):
+        return self._tokens.data_of(self._last_accepted_index)
 
     def raise_error(self, error_class, msg):
-        raise error_class(f'{msg} in {self._current_token.location}')
+        # Source locations are only materialized when reporting an error
+        raise error_class(f'{msg} in {self._tokens.location(self._index)}')
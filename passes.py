@@ -0,0 +1,591 @@
+import heapq
+
+from ir import *
+
+
+# Optimization passes over the IR instructions of the code generator's
+# basic-blocks, which are [opcode, result, operands...] lists of Values.
+# Variables and temporaries are both referred to by their names, and
+# immediates are the Values whose name is a number.
+
+# The position of the result (or None) and the slice of the used operands,
+# by opcode, for the instructions that aren't [operator, result, operands...]
+OPERAND_LAYOUTS = {
+    Input: (1, slice(0, 0)),
+    Output: (None, slice(1, 2)),
+    CondBr: (None, slice(2, 3)),
+    Jump: (None, slice(0, 0)),
+    Halt: (None, slice(0, 0)),
+}
+OPERATOR_LAYOUT = (1, slice(2, None))
+
+
+def defined_value(instr):
+    # The Value an instruction writes to, or None
+    result_index, _ = OPERAND_LAYOUTS.get(instr[0], OPERATOR_LAYOUT)
+    return instr[1] if result_index is not None else None
+
+
+def used_values(instr):
+    return instr[OPERAND_LAYOUTS.get(instr[0], OPERATOR_LAYOUT)[1]]
+
+
+def is_pure(instr):
+    # Whether an instruction can be dropped when its result is not used. Input
+    # consumes a value, and a division traps unless its divisor is a non-zero immediate.
+    opcode = instr[0]
+    if opcode is Div:
+        divisor = instr[3].name
+        return type(divisor) is not str and divisor != 0
+    return opcode is not Input and defined_value(instr) is not None
+
+
+class Liveness:
+    """
+    The names that are live at the start and end of each reachable basic-block.
+
+    Only names that are used before being written in some block can be live
+    across blocks, so only they are tracked here, as bits of an int. The others
+    are temporaries that are only live within a block. Nothing is live at the
+    Halt, since a halted program has no state left to observe.
+
+    summaries optionally maps each block to its (upward-exposed uses, written
+    names), as returned by summarize_block(), to save scanning the instructions.
+    bits optionally gives the bits of the names, which must include all of the
+    upward-exposed ones.
+    """
+
+    def __init__(self, cfg, summaries=None, bits=None):
+        if summaries is None:
+            summaries = {bb: summarize_block(bb) for bb in cfg.preorder}
+
+        # Bit of each name that can be live across blocks
+        if bits is None:
+            bits = {}
+            for bb in cfg.preorder:
+                for name in summaries[bb][0]:
+                    if name not in bits:
+                        bits[name] = 1 << len(bits)
+        self.bits = bits
+        # Names by bit index, see live_out_names()
+        self._names = None
+
+        use_bits = {}
+        kill_bits = {}
+        for bb in cfg.preorder:
+            use, kill = summaries[bb]
+            use_bits[bb] = sum(bits[name] for name in use)
+            kill_bits[bb] = sum(bits[name] for name in kill if name in bits)
+
+        # A backward problem, so blocks are first visited in postorder, where
+        # successors come before their predecessors (except along back edges)
+        self.live_in = dict.fromkeys(cfg.preorder, 0)
+        self.live_out = dict.fromkeys(cfg.preorder, 0)
+        worklist = cfg.postorder[::-1]
+        pending = set(worklist)
+        while len(worklist) > 0:
+            bb = worklist.pop()
+            pending.discard(bb)
+            live_out = 0
+            for succ in bb.successors:
+                live_out |= self.live_in[succ]
+            self.live_out[bb] = live_out
+            live_in = use_bits[bb] | (live_out & ~kill_bits[bb])
+            if live_in != self.live_in[bb]:
+                self.live_in[bb] = live_in
+                for pred in bb.predecessors:
+                    if pred not in pending and cfg.is_reachable(pred):
+                        pending.add(pred)
+                        worklist.append(pred)
+
+    def live_out_names(self, bb):
+        return set(_names_of_bits(self.live_out.get(bb, 0), self.bit_names()))
+
+    def bit_names(self):
+        # The tracked names, by the index of their bit
+        if self._names is None:
+            self._names = [None] * len(self.bits)
+            for name, bit in self.bits.items():
+                self._names[bit.bit_length() - 1] = name
+        return self._names
+
+
+def summarize_block(bb):
+    # The names used in the block before being written in it, and the written names
+    use = set()
+    kill = set()
+    for instr in reversed(bb.instructions):
+        result_index, uses = OPERAND_LAYOUTS.get(instr[0], OPERATOR_LAYOUT)
+        if result_index is not None:
+            name = instr[1].name
+            use.discard(name)
+            kill.add(name)
+        for value in instr[uses]:
+            if type(value.name) is str:
+                use.add(value.name)
+    return use, kill
+
+
+def eliminate_dead_code(cfg):
+    """
+    Removes the basic-blocks that are unreachable from the entry, and the pure
+    instructions whose result is never used, until none are left. Returns the
+    numbers of removed blocks and instructions. Blocks are removed from
+    cfg.blocks in place and may be left empty, so the graph must be rebuilt.
+    """
+    reachable_blocks = [bb for bb in cfg.blocks if cfg.is_reachable(bb)]
+    removed_blocks = len(cfg.blocks) - len(reachable_blocks)
+    cfg.blocks[:] = reachable_blocks
+
+    # Removing an instruction may leave the ones computing its operands unused.
+    # Within a block they are removed by the same backward sweep, so after the
+    # first round only the blocks where fewer names are live at the end than
+    # before are swept again.
+    summaries = {bb: summarize_block(bb) for bb in cfg.preorder}
+    # Upward-exposed uses only disappear, so the bits of the first round remain valid
+    liveness = Liveness(cfg, summaries)
+    blocks = cfg.preorder
+    removed_instrs = 0
+    while len(blocks) > 0:
+        for bb in blocks:
+            removed, summaries[bb] = _sweep_block(bb, liveness.live_out[bb], liveness.bits)
+            removed_instrs += removed
+        previous_live_out = liveness.live_out
+        liveness = Liveness(cfg, summaries, liveness.bits)
+        blocks = [bb for bb in cfg.preorder if liveness.live_out[bb] != previous_live_out[bb]]
+
+    return removed_blocks, removed_instrs
+
+
+def _sweep_block(bb, live, bits):
+    # A backward walk from the end of the block, where live holds the bits of
+    # the names live across blocks and local_live the other live names. Returns
+    # the number of removed instructions and the summary of the remaining ones.
+    local_live = set()
+    use = set()
+    kill = set()
+    kept = []
+    for instr in reversed(bb.instructions):
+        result_index, uses = OPERAND_LAYOUTS.get(instr[0], OPERATOR_LAYOUT)
+        if result_index is not None:
+            name = instr[1].name
+            bit = bits.get(name)
+            is_live = live & bit if bit is not None else name in local_live
+            if not is_live and is_pure(instr):
+                continue
+            if bit is not None:
+                live &= ~bit
+            else:
+                local_live.discard(name)
+            use.discard(name)
+            kill.add(name)
+
+        for value in instr[uses]:
+            name = value.name
+            if type(name) is str:
+                use.add(name)
+                bit = bits.get(name)
+                if bit is not None:
+                    live |= bit
+                else:
+                    local_live.add(name)
+        kept.append(instr)
+
+    removed = len(bb.instructions) - len(kept)
+    if removed > 0:
+        kept.reverse()
+        bb.instructions = kept
+    return removed, (use, kill)
+
+
+def allocate_temporaries(cfg):
+    """
+    Renames the temporaries so that those that are never live at the same time
+    share a name, by a linear scan over the blocks in layout order. int and
+    float temporaries get separate names. Returns the numbers of temporaries
+    before and after.
+    """
+    liveness = Liveness(cfg)
+    bit_names = liveness.bit_names()
+
+    # Each temporary is live within [start, end] in the layout, where the
+    # instruction at index i reads its operands at 2 * i and writes at 2 * i + 1,
+    # so a result can take the name of an operand that isn't used afterwards
+    temps = {}
+    starts = {}
+    ends = {}
+
+    def mark(name, position):
+        if name not in starts:
+            starts[name] = ends[name] = position
+        elif position < starts[name]:
+            starts[name] = position
+        elif position > ends[name]:
+            ends[name] = position
+
+    position = 0
+    for bb in cfg.blocks:
+        for name in _names_of_bits(liveness.live_in.get(bb, 0), bit_names):
+            mark(name, position)
+
+        for instr in bb.instructions:
+            result_index, uses = OPERAND_LAYOUTS.get(instr[0], OPERATOR_LAYOUT)
+            for value in instr[uses]:
+                if value.temporary:
+                    temps[value.name] = value
+                    mark(value.name, position)
+            if result_index is not None and instr[1].temporary:
+                temps[instr[1].name] = instr[1]
+                mark(instr[1].name, position + 1)
+            position += 2
+
+        for name in _names_of_bits(liveness.live_out.get(bb, 0), bit_names):
+            mark(name, position - 1)
+
+    # Names are reused lowest first, from separate pools for each type
+    free_names = {}
+    active = []
+    allocated = 0
+    intervals = sorted((starts[name], ends[name], name) for name in temps)
+    for start, end, name in intervals:
+        while len(active) > 0 and active[0][0] < start:
+            _, index, type_class = heapq.heappop(active)
+            heapq.heappush(free_names.setdefault(type_class, []), index)
+
+        value = temps[name]
+        pool = free_names.get(value.type_class)
+        if pool:
+            index = heapq.heappop(pool)
+        else:
+            allocated += 1
+            index = allocated
+        heapq.heappush(active, (end, index, value.type_class))
+        value.name = f't{index}'
+
+    return len(temps), allocated
+
+
+def _names_of_bits(bits, bit_names):
+    while bits:
+        low_bit = bits & -bits
+        yield bit_names[low_bit.bit_length() - 1]
+        bits ^= low_bit
+
+
+# Operators whose operands can be swapped
+COMMUTATIVE_OPERATORS = {Add, Mul, Equal, NotEqual}
+
+
+def eliminate_common_subexpressions(cfg, across_blocks=False):
+    """
+    Value numbering: an operator that computes the same value as an earlier
+    one in the same basic-block reuses its result instead. Values are numbered
+    by the opcode and the numbers of the operands (in either order for the
+    commutative operators), and writing to a variable, by an assignment or an
+    input, gives it a new number.
+
+    With across_blocks, a block also reuses the results computed in the blocks
+    that dominate it, and the numbers of the variables carry over to a block
+    from its only predecessor. Returns the number of reused results, which are
+    either dropped or turned into assignments, so blocks may be left empty.
+    """
+    # Temporaries that are written once hold their value wherever they are
+    # used, so they can stand in for any later operator computing the same value
+    numbering = _ValueNumbering(_single_write_temporaries(cfg))
+
+    if not across_blocks:
+        for bb in cfg.preorder:
+            numbering.number_block(bb)
+            numbering.undo(0)
+        return numbering.reused
+
+    # A walk over the dominator tree, where the tables are restored when
+    # leaving a block, so each block only sees the entries of its dominators.
+    # Frames are (block, depth, base), where base is the depth of the nearest
+    # dominator (or the block itself) whose variables don't carry over from
+    # its predecessor.
+    stack = [(cfg.entry, 0, 0)]
+    while len(stack) > 0:
+        bb, depth, base = stack.pop()
+        if bb is None:
+            numbering.undo(depth)
+            continue
+        if len(bb.predecessors) != 1:
+            base = depth
+        numbering.depth = depth
+        numbering.base = base
+        stack.append((None, len(numbering.undo_log), None))
+        numbering.number_block(bb)
+        stack.extend((child, depth + 1, base) for child in cfg.dominator_tree[bb])
+    return numbering.reused
+
+
+def _single_write_temporaries(cfg):
+    # Temporaries written by a single instruction, which the code generator
+    # places before all of their uses. The others are the results of && and ||.
+    writes = {}
+    for bb in cfg.blocks:
+        for instr in bb.instructions:
+            result = defined_value(instr)
+            if result is not None and result.temporary:
+                writes[result] = writes.get(result, 0) + 1
+    return {value for value, count in writes.items() if count == 1}
+
+
+class _ValueNumbering:
+    # Missing entries in the undo log
+    _MISSING = object()
+
+    def __init__(self, single_writes):
+        self.single_writes = single_writes
+        # Numbers of the temporaries in single_writes and of immediates, which never change
+        self.constant_numbers = {}
+        # Numbers of the other names, as (number, depth of the block that wrote it)
+        self.name_numbers = {}
+        # Numbers by (opcode, result type, operand numbers...)
+        self.expressions = {}
+        # The Value that holds each number
+        self.holders = {}
+        # Dropped results, by the Value that holds them
+        self.replacements = {}
+        # (table, key, previous value) of each change to the tables
+        self.undo_log = []
+        self.count = 0
+        self.reused = 0
+        # Names written in blocks above base in the dominator tree may have
+        # been written again on the way to the current block
+        self.depth = 0
+        self.base = 0
+
+    def undo(self, mark):
+        undo_log = self.undo_log
+        missing = self._MISSING
+        while len(undo_log) > mark:
+            table, key, previous = undo_log.pop()
+            if previous is missing:
+                del table[key]
+            else:
+                table[key] = previous
+
+    def _set(self, table, key, value):
+        self.undo_log.append((table, key, table.get(key, self._MISSING)))
+        table[key] = value
+
+    def _new_number(self):
+        self.count += 1
+        return self.count
+
+    def _name_number(self, name):
+        entry = self.name_numbers.get(name)
+        if entry is None or entry[1] < self.base:
+            return None
+        return entry[0]
+
+    def number_of(self, value):
+        if value in self.single_writes:
+            key = value
+        elif type(value.name) is str:
+            number = self._name_number(value.name)
+            if number is None:
+                number = self._new_number()
+                self._set(self.name_numbers, value.name, (number, self.depth))
+            return number
+        else:
+            # Immediates are the same if they are printed the same, which tells -0.0 from 0.0
+            key = (value.type_class, str(value.name))
+
+        number = self.constant_numbers.get(key)
+        if number is None:
+            number = self._new_number()
+            self._set(self.constant_numbers, key, number)
+        return number
+
+    def _holder(self, number):
+        # The Value that still holds number, or None
+        holder = self.holders.get(number)
+        if holder is None or holder in self.single_writes or self._name_number(holder.name) == number:
+            return holder
+        return None
+
+    def _write(self, result, number):
+        if result in self.single_writes:
+            self._set(self.constant_numbers, result, number)
+        else:
+            self._set(self.name_numbers, result.name, (number, self.depth))
+        # Temporaries are preferred, since they are never written again
+        holder = self._holder(number)
+        if holder is None or (holder not in self.single_writes and result in self.single_writes):
+            self._set(self.holders, number, result)
+
+    def number_block(self, bb):
+        replacements = self.replacements
+        kept = []
+        for instr in bb.instructions:
+            opcode = instr[0]
+            result_index, uses = OPERAND_LAYOUTS.get(opcode, OPERATOR_LAYOUT)
+            for i in range(*uses.indices(len(instr))):
+                instr[i] = replacements.get(instr[i], instr[i])
+            if result_index is None:
+                kept.append(instr)
+                continue
+
+            result = instr[1]
+            if opcode is Input:
+                self._write(result, self._new_number())
+            elif opcode is Assign:
+                self._write(result, self.number_of(instr[2]))
+            else:
+                numbers = [self.number_of(value) for value in instr[2:]]
+                if opcode in COMMUTATIVE_OPERATORS:
+                    numbers.sort()
+                key = (opcode, result.type_class, *numbers)
+                number = self.expressions.get(key)
+                if number is None:
+                    number = self._new_number()
+                    self._set(self.expressions, key, number)
+                else:
+                    holder = self._holder(number)
+                    if holder is not None:
+                        self.reused += 1
+                        # A variable may be written again before the result
+                        # is used, so only temporaries stand in for it
+                        if result in self.single_writes and holder in self.single_writes:
+                            replacements[result] = holder
+                            continue
+                        instr = [Assign, result, holder]
+                self._write(result, number)
+            kept.append(instr)
+        bb.instructions = kept
+
+
+def hoist_loop_invariants(cfg, insert_preheader):
+    """
+    Loop-invariant code motion: moves the operators whose operands are not
+    written in a loop into its preheader, a block that runs once before the
+    loop is entered. Each is moved straight out of all the loops in which it
+    is invariant. Returns the number of hoisted instructions.
+
+    Only operators whose result is a temporary written once are moved, and only
+    if they are pure, so computing them when the loop body wouldn't have is
+    harmless. A division that may trap is only moved out of the header of its
+    loop, which runs at least once whenever the loop is entered (it tests a
+    while's condition), and only if nothing that can be observed comes before
+    it there.
+
+    insert_preheader(header, entries) is called for the loops that something
+    is hoisted into. It must return a new labeled block, and redirect the
+    branches of the entries (the predecessors of the header from outside the
+    loop) to it. The preheader is laid out right before the header, so that the
+    block before it falls through to it. cfg.blocks is updated in place, but the
+    rest of the graph is left out of date.
+    """
+    single_writes = _single_write_temporaries(cfg)
+    position = {bb: i for i, bb in enumerate(cfg.blocks)}
+
+    # Bits of the names written in each loop, including its nested loops,
+    # except for the temporaries in single_writes, whose blocks are recorded
+    bits = {}
+    loop_bits = {}
+    def_blocks = {}
+    for loop in reversed(cfg.loops):
+        written = 0
+        for bb in loop.own_blocks:
+            for instr in bb.instructions:
+                result = defined_value(instr)
+                if result is None:
+                    continue
+                if result in single_writes:
+                    def_blocks[result] = bb
+                    continue
+                bit = bits.get(result.name)
+                if bit is None:
+                    bit = bits[result.name] = 1 << len(bits)
+                written |= bit
+        for child in loop.children:
+            written |= loop_bits[child]
+        loop_bits[loop] = written
+
+    # Loops are visited outermost first, along with the path of loops that
+    # contain them. The level of a value is the depth of the innermost loop
+    # on the path in which it may change, or 0, and an instruction can be
+    # moved into the preheader of the loop one deeper than its operands' levels.
+    levels = {}
+    preheaders = {}
+    path = []
+    hoisted = 0
+
+    def level_of(value):
+        if value in single_writes:
+            level = levels.get(value)
+            if level is None:
+                # Written before any loop, or else in a block not visited yet
+                return 0 if value not in def_blocks else len(path)
+            return level
+        bit = bits.get(value.name) if type(value.name) is str else None
+        if bit is None:
+            return 0
+        # The loops that write the name are a prefix of the path
+        low, high = 0, len(path)
+        while low < high:
+            middle = (low + high) // 2
+            if loop_bits[path[middle]] & bit:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def preheader_of(loop):
+        preheader = preheaders.get(loop.header)
+        if preheader is None:
+            # The block before the header must not fall through to it from inside the loop
+            previous_index = position[loop.header] - 1
+            if previous_index >= 0 and cfg.loop_contains(loop, cfg.blocks[previous_index]):
+                return None
+            entries = [pred for pred in loop.header.predecessors if pred not in loop.latches]
+            preheader = preheaders[loop.header] = insert_preheader(loop.header, entries)
+        return preheader
+
+    for loop in cfg.loops:
+        while len(path) > 0 and path[-1] is not loop.parent:
+            path.pop()
+        path.append(loop)
+        depth = len(path)
+
+        for bb in sorted(loop.own_blocks, key=position.__getitem__):
+            kept = []
+            observed = False
+            for instr in bb.instructions:
+                opcode = instr[0]
+                if opcode is Input or opcode is Output:
+                    observed = True
+                result_index, _ = OPERAND_LAYOUTS.get(opcode, OPERATOR_LAYOUT)
+                if result_index is None or instr[1] not in single_writes:
+                    kept.append(instr)
+                    continue
+
+                level = 0
+                for value in instr[2:]:
+                    level = max(level, level_of(value))
+                if not is_pure(instr):
+                    level = depth - 1 if bb is loop.header and not observed and level < depth else depth
+
+                preheader = preheader_of(path[level]) if level < depth else None
+                if preheader is None:
+                    levels[instr[1]] = depth
+                    kept.append(instr)
+                    continue
+                preheader.instructions.append(instr)
+                levels[instr[1]] = level
+                hoisted += 1
+            if len(kept) < len(bb.instructions):
+                bb.instructions = kept
+
+    if len(preheaders) > 0:
+        blocks = []
+        for bb in cfg.blocks:
+            preheader = preheaders.get(bb)
+            if preheader is not None:
+                blocks.append(preheader)
+            blocks.append(bb)
+        cfg.blocks[:] = blocks
+    return hoisted
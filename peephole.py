@@ -0,0 +1,189 @@
+import re
+
+
+class PeepholeRule:
+    """
+    Rewrites a sequence of back-end instructions that matches pattern into
+    replacement. Both are lists of instruction templates, such as
+    '{p}ADD {d} 0 {a}', where each word is the opcode or an operand.
+
+    A word is either a number, which matches an equal numeric operand, or a
+    name with at most one {variable} in it. A bare {variable} matches any
+    operand, and otherwise the variable matches the rest of a name between
+    the given prefix and suffix. A variable must match the same value
+    wherever it appears. The replacement is instantiated with the bindings of
+    the variables.
+
+    dead lists the templates of names that must not be read after the matched
+    instructions (before being written again), since the replacement leaves
+    other values in them, or doesn't write them at all. where optionally takes
+    the bindings, and returns either None to reject the match, or a dict of
+    more bindings for the replacement.
+    """
+
+    __slots__ = ('name', 'pattern', 'replacement', 'dead', 'where')
+
+    _WORD = re.compile(r'(\w*)\{(\w+)\}(\w*)$')
+
+    def __init__(self, name, pattern, replacement, dead=(), where=None):
+        self.name = name
+        self.pattern = [self._parse(template) for template in pattern]
+        self.replacement = [self._parse(template) for template in replacement]
+        self.dead = [self._parse_word(template) for template in dead]
+        self.where = where
+
+    @classmethod
+    def _parse(cls, template):
+        opcode, *operands = template.split()
+        return cls._parse_word(opcode), [cls._parse_word(operand) for operand in operands]
+
+    @classmethod
+    def _parse_word(cls, word):
+        # (prefix, variable, suffix), or (literal, None, None)
+        match = cls._WORD.match(word)
+        if match is not None:
+            return match.groups()
+        try:
+            return int(word), None, None
+        except ValueError:
+            pass
+        try:
+            return float(word), None, None
+        except ValueError:
+            return word, None, None
+
+    @staticmethod
+    def _match_word(word, value, bindings):
+        prefix, variable, suffix = word
+        if variable is None:
+            if type(prefix) is str:
+                return value == prefix
+            return type(value) is not str and value == prefix
+
+        if prefix or suffix:
+            if type(value) is not str or len(value) < len(prefix) + len(suffix) \
+                    or not value.startswith(prefix) or not value.endswith(suffix):
+                return False
+            value = value[len(prefix):len(value) - len(suffix)]
+        bound = bindings.get(variable, bindings)
+        if bound is bindings:
+            bindings[variable] = value
+            return True
+        return bound == value and type(bound) is type(value)
+
+    @staticmethod
+    def _instantiate_word(word, bindings):
+        prefix, variable, suffix = word
+        if variable is None:
+            return prefix
+        if prefix or suffix:
+            return f'{prefix}{bindings[variable]}{suffix}'
+        return bindings[variable]
+
+    def matches_first(self, instr):
+        # Whether the first instruction of the pattern can match instr, ignoring variables
+        return self._match_word(self.pattern[0][0], instr.opcode, {})
+
+    def match(self, window):
+        # The bindings if the instructions of window (in order) match the pattern, or None
+        bindings = {}
+        for (opcode, operands), instr in zip(self.pattern, window):
+            if len(operands) != len(instr.operands) or not self._match_word(opcode, instr.opcode, bindings):
+                return None
+            for word, value in zip(operands, instr.operands):
+                if not self._match_word(word, value, bindings):
+                    return None
+        if self.where is not None:
+            extra = self.where(bindings)
+            if extra is None:
+                return None
+            bindings.update(extra)
+        return bindings
+
+    def dead_names(self, bindings):
+        return [self._instantiate_word(word, bindings) for word in self.dead]
+
+    def instantiate(self, bindings, instruction_class):
+        return [instruction_class(self._instantiate_word(opcode, bindings),
+                                  *(self._instantiate_word(word, bindings) for word in operands))
+                for opcode, operands in self.replacement]
+
+
+class Peephole:
+    """
+    Applies PeepholeRules to the instructions of basic-blocks until none of
+    them matches. A window slides over the instructions, where the first rule
+    (in order) that matches at the start of the window is applied. The window
+    then moves back, so that the rewritten instructions are matched again,
+    along with the patterns that may now match from before them.
+
+    Windows never cross basic-blocks, since only their first instruction can be
+    a branch target. Instructions whose opcode is in reading_opcodes read all of
+    their operands, the others write their first operand and read the rest.
+    Rules must not undo each other, or the optimizer wouldn't terminate.
+    """
+
+    def __init__(self, rules, reading_opcodes):
+        self.rules = rules
+        self.reading_opcodes = reading_opcodes
+        self.max_length = max((len(rule.pattern) for rule in rules), default=1)
+        # Number of times each rule was applied, by its name
+        self.hits = {rule.name: 0 for rule in rules}
+        # The rules that may match at an instruction, by its opcode
+        self._rules_by_opcode = {}
+
+    def optimize(self, instructions, live_out):
+        """
+        Returns the rewritten instructions of a basic-block, where live_out
+        holds the names that are live at its end.
+        """
+        if len(self.rules) == 0:
+            return instructions
+
+        # The instructions left to match, the next one last
+        pending = instructions[::-1]
+        done = []
+        while len(pending) > 0:
+            instr = pending[-1]
+            rules = self._rules_by_opcode.get(instr.opcode)
+            if rules is None:
+                rules = self._rules_by_opcode[instr.opcode] = [rule for rule in self.rules
+                                                               if rule.matches_first(instr)]
+            for rule in rules:
+                length = len(rule.pattern)
+                if length > len(pending):
+                    continue
+                window = pending[:-length - 1:-1]
+                bindings = rule.match(window)
+                if bindings is None:
+                    continue
+                if not all(self._is_dead(name, pending, len(pending) - length, live_out)
+                           for name in rule.dead_names(bindings)):
+                    continue
+
+                del pending[-length:]
+                pending.extend(reversed(rule.instantiate(bindings, type(instr))))
+                self.hits[rule.name] += 1
+                # Patterns that start up to max_length - 1 instructions earlier may match now
+                for _ in range(min(self.max_length - 1, len(done))):
+                    pending.append(done.pop())
+                break
+            else:
+                done.append(pending.pop())
+
+        return done
+
+    def _is_dead(self, name, pending, end, live_out):
+        # Whether name is written before it is read in pending[end - 1::-1], or
+        # else isn't live at the end of the block
+        for i in range(end - 1, -1, -1):
+            instr = pending[i]
+            if instr.opcode in self.reading_opcodes:
+                if name in instr.operands:
+                    return False
+                continue
+            if name in instr.operands[1:]:
+                return False
+            if len(instr.operands) > 0 and instr.operands[0] == name:
+                return True
+        return name not in live_out
@@ -1,5 +1,7 @@
+import utils
 from ir import *
-from codegen import Value
+from codegen import Instruction, Label
+from peephole import PeepholeRule
 
 
 class Quad:
@@ -7,137 +9,168 @@ class Quad:
     class Error(Exception):
         pass
 
+    # Mappers of IR opcodes, called with the opcode and the operands of the instruction
+    _mappers = utils.TypeDispatch()
+
+    PREFIXES = {
+        Integer: 'I',
+        Float: 'R',
+    }
+
+    JUMP_OPCODE = 'JUMP'
+    BRANCH_OPCODES = {'JUMP', 'JMPZ'}
+    # Opcodes that don't write their first operand
+    READING_OPCODES = {'IPRT', 'RPRT', 'JUMP', 'JMPZ', 'HALT'}
+
+    # <= and >= are expanded into three instructions, see _map_less_or_equal()
+    PEEPHOLE_RULES = [
+        # An int compared with a constant only needs one comparison: a <= n is a < n + 1
+        PeepholeRule('le-int-constant',
+                     ['ILSS _{d} {a} {n}', 'IEQL {d} {a} {n}', 'IADD {d} {d} _{d}'],
+                     ['ILSS {d} {a} {m}'],
+                     dead=['_{d}'],
+                     where=lambda b: {'m': b['n'] + 1} if type(b['n']) is int else None),
+        PeepholeRule('ge-int-constant',
+                     ['IGRT _{d} {a} {n}', 'IEQL {d} {a} {n}', 'IADD {d} {d} _{d}'],
+                     ['IGRT {d} {a} {m}'],
+                     dead=['_{d}'],
+                     where=lambda b: {'m': b['n'] - 1} if type(b['n']) is int else None),
+        # Branching on an int a <= b is branching on a > b with the targets swapped
+        # (floats aren't ordered when one of them is NaN)
+        PeepholeRule('le-branch',
+                     ['ILSS _{d} {a} {b}', 'IEQL {d} {a} {b}', 'IADD {d} {d} _{d}',
+                      'JMPZ {false} {d}', 'JUMP {true}'],
+                     ['IGRT {d} {a} {b}', 'JMPZ {true} {d}', 'JUMP {false}'],
+                     dead=['{d}', '_{d}']),
+        PeepholeRule('ge-branch',
+                     ['IGRT _{d} {a} {b}', 'IEQL {d} {a} {b}', 'IADD {d} {d} _{d}',
+                      'JMPZ {false} {d}', 'JUMP {true}'],
+                     ['ILSS {d} {a} {b}', 'JMPZ {true} {d}', 'JUMP {false}'],
+                     dead=['{d}', '_{d}']),
+        # && and || normalize their operands to 0 or 1, which comparisons already are
+        *(PeepholeRule(f'{name.lower()}-normalized',
+                       [f'{{p}}{name} {{t}} {{a}} {{b}}', 'INQL {t} {t} 0'],
+                       [f'{{p}}{name} {{t}} {{a}} {{b}}'])
+          for name in ['EQL', 'NQL', 'LSS', 'GRT']),
+        *(PeepholeRule(f'{name.lower()}-normalized',
+                       [f'{{p}}{name} {{t}} {{a}} {{b}}', 'INQL {d} {t} 0'],
+                       [f'{{p}}{name} {{d}} {{a}} {{b}}'],
+                       dead=['{t}'])
+          for name in ['EQL', 'NQL', 'LSS', 'GRT']),
+        # Unary plus on an int (adding 0 turns a float -0.0 into 0.0)
+        PeepholeRule('add-zero', ['IADD {d} 0 {a}'], ['IASN {d} {a}']),
+        PeepholeRule('self-assign', ['{p}ASN {d} {d}'], []),
+        # Branches on constants
+        PeepholeRule('jmpz-zero', ['JMPZ {label} 0'], ['JUMP {label}']),
+        PeepholeRule('jmpz-nonzero', ['JMPZ {label} {n}'], [],
+                     where=lambda b: {} if type(b['n']) is not str and b['n'] != 0 else None),
+        # A jump right after another one is never reached
+        PeepholeRule('unreachable-jump', ['JUMP {label}', 'JUMP {other}'], ['JUMP {label}']),
+    ]
+
+    # Opcodes that map to a single instruction with the same operands
+    OPCODE_NAMES = {
+        Add: 'ADD',
+        Sub: 'SUB',
+        Mul: 'MLT',
+        Div: 'DIV',
+        Equal: 'EQL',
+        NotEqual: 'NQL',
+        Less: 'LSS',
+        Greater: 'GRT',
+    }
+
     @classmethod
     def map_instruction(cls, instr):
         assert len(instr) >= 1
-        opcode, *rest = instr
-
-        if len(rest) >= 3 and isinstance(rest[2], Value):
-            arg2 = rest[2]
-            a2 = arg2.name
-        if len(rest) >= 2 and isinstance(rest[1], Value):
-            arg1 = rest[1]
-            a1 = arg1.name
-        if len(rest) >= 1 and isinstance(rest[0], Value):
-            result = rest[0]
-            dst = result.name
-            instr_type_class = (arg1 if issubclass(opcode, Compare) else result).type_class
-            if instr_type_class is Integer:
-                prefix = 'I'
-            elif instr_type_class is Float:
-                prefix = 'R'
-
-        if opcode is Input:
-            instrs = [f'{prefix}INP {dst}']
-
-        elif opcode is Output:
-            instrs = [f'{prefix}PRT {dst}']
-
-        elif opcode is StaticCast:
-            if result.type_class is Integer:
-                instrs = [f'RTOI {dst} {a1}']
-            else:
-                instrs = [f'ITOR {dst} {a1}']
-
-        elif opcode is UnaryAdd:
-            instrs = [f'{prefix}ADD {dst} 0 {a1}']
-
-        elif opcode is Negate:
-            instrs = [f'{prefix}SUB {dst} 0 {a1}']
-
-        elif opcode is Not:
-            instrs = [f'{prefix}EQL {dst} {a1} 0']
-
-        elif opcode is Assign:
-            instrs = [f'{prefix}ASN {dst} {a1}']
-
-        elif opcode is Or:
-            instrs = []
-
-            if isinstance(arg1, int) or isinstance(arg1, float):
-                normalized_arg1 = int(arg1 == 0)
-            else:
-                normalized_arg1 = f'_{a1}'
-                instrs.append(f'{prefix}EQL {normalized_arg1} {a1} 0')
-
-            if isinstance(arg2, int) or isinstance(arg2, float):
-                normalized_arg2 = int(arg2 == 0)
-            else:
-                normalized_arg2 = f'_{a2}'
-                instrs.append(f'{prefix}EQL {normalized_arg2} {a2} 0')
-
-            instrs.append(f'{prefix}ADD {dst} {normalized_arg1} {normalized_arg2}')
-            return instrs
-
-        elif opcode is And:
-            instrs = []
-
-            if isinstance(arg1, int) or isinstance(arg1, float):
-                normalized_arg1 = int(arg1 == 0)
-            else:
-                normalized_arg1 = f'_{a1}'
-                instrs.append(f'{prefix}EQL {normalized_arg1} {a1} 0')
-
-            if isinstance(arg2, int) or isinstance(arg2, float):
-                normalized_arg2 = int(arg2 == 0)
-            else:
-                normalized_arg2 = f'_{a2}'
-                instrs.append(f'{prefix}EQL {normalized_arg2} {a2} 0')
-
-            instrs.append(f'{prefix}MLT {dst} {normalized_arg1} {normalized_arg2}')
-            return instrs
-
-        elif opcode is Equal:
-            instrs = [f'{prefix}EQL {dst} {a1} {a2}']
-
-        elif opcode is NotEqual:
-            instrs = [f'{prefix}NQL {dst} {a1} {a2}']
-
-        elif opcode is Less:
-            instrs = [f'{prefix}LSS {dst} {a1} {a2}']
-
-        elif opcode is Greater:
-            instrs = [f'{prefix}GRT {dst} {a1} {a2}']
-
-        elif opcode is LessOrEqual:
-            temp_dst = f'_{dst}'
-            return [
-                f'{prefix}EQL {dst} {a1} {a2}',
-                f'{prefix}LSS {temp_dst} {a1} {a2}',
-                f'{prefix}ADD {dst} {dst} {temp_dst}']
-
-        elif opcode is GreaterOrEqual:
-            temp_dst = f'_{dst}'
-            return [
-                f'{prefix}EQL {dst} {a1} {a2}',
-                f'{prefix}GRT {temp_dst} {a1} {a2}',
-                f'{prefix}ADD {dst} {dst} {temp_dst}']
-
-        elif opcode is Add:
-            instrs = [f'{prefix}ADD {dst} {a1} {a2}']
-
-        elif opcode is Sub:
-            instrs = [f'{prefix}SUB {dst} {a1} {a2}']
-
-        elif opcode is Mul:
-            instrs = [f'{prefix}MLT {dst} {a1} {a2}']
-
-        elif opcode is Div:
-            instrs = [f'{prefix}DIV {dst} {a1} {a2}']
-
-        elif opcode is Jump:
-            _, label = rest
-            instrs = [f'JUMP <{label}>']
-
-        elif opcode is CondBr:
-            _, test_result, true_label, false_label = rest
-            instrs = [f'JMPZ <{false_label}> {test_result.name}',
-                      f'JUMP <{true_label}>']
-
-        elif opcode is Halt:
-            instrs = ['HALT']
-
-        else:
-            raise cls.Error(f'{cls.__name__} back-end does not support {opcode}')
-
-        return instrs
+        mapper = cls._mappers.lookup(instr[0])
+        if mapper is None:
+            raise cls.Error(f'{cls.__name__} back-end does not support {instr[0]}')
+        return mapper(*instr)
+
+    @_mappers.register(Input)
+    @staticmethod
+    def _map_input(opcode, result):
+        return [Instruction(Quad.PREFIXES[result.type_class] + 'INP', result.name)]
+
+    @_mappers.register(Output)
+    @staticmethod
+    def _map_output(opcode, result):
+        return [Instruction(Quad.PREFIXES[result.type_class] + 'PRT', result.name)]
+
+    @_mappers.register(StaticCast)
+    @staticmethod
+    def _map_static_cast(opcode, result, arg1):
+        if result.type_class is Integer:
+            return [Instruction('RTOI', result.name, arg1.name)]
+        return [Instruction('ITOR', result.name, arg1.name)]
+
+    @_mappers.register(UnaryAdd)
+    @staticmethod
+    def _map_unary_add(opcode, result, arg1):
+        return [Instruction(Quad.PREFIXES[result.type_class] + 'ADD', result.name, 0, arg1.name)]
+
+    @_mappers.register(Negate)
+    @staticmethod
+    def _map_negate(opcode, result, arg1):
+        return [Instruction(Quad.PREFIXES[result.type_class] + 'SUB', result.name, 0, arg1.name)]
+
+    @_mappers.register(Not)
+    @staticmethod
+    def _map_not(opcode, result, arg1):
+        # The prefix is the one of the argument, the result is always an int
+        return [Instruction(Quad.PREFIXES[arg1.type_class] + 'EQL', result.name, arg1.name, 0)]
+
+    @_mappers.register(Assign)
+    @staticmethod
+    def _map_assign(opcode, result, arg1):
+        return [Instruction(Quad.PREFIXES[result.type_class] + 'ASN', result.name, arg1.name)]
+
+    @_mappers.register(BinaryOperator)
+    @staticmethod
+    def _map_binary_operator(opcode, result, arg1, arg2):
+        # Comparisons take the prefix of their arguments, the result is always an int
+        prefix = Quad.PREFIXES[arg1.type_class]
+        name = Quad.OPCODE_NAMES.get(opcode)
+        if name is None:
+            raise Quad.Error(f'Quad back-end does not support {opcode}')
+        return [Instruction(prefix + name, result.name, arg1.name, arg2.name)]
+
+    @_mappers.register(LessOrEqual)
+    @staticmethod
+    def _map_less_or_equal(opcode, result, arg1, arg2):
+        # Both comparisons are done before dst is written, since it may be an argument
+        prefix = Quad.PREFIXES[arg1.type_class]
+        dst = result.name
+        temp_dst = f'_{dst}'
+        return [
+            Instruction(prefix + 'LSS', temp_dst, arg1.name, arg2.name),
+            Instruction(prefix + 'EQL', dst, arg1.name, arg2.name),
+            Instruction(prefix + 'ADD', dst, dst, temp_dst)]
+
+    @_mappers.register(GreaterOrEqual)
+    @staticmethod
+    def _map_greater_or_equal(opcode, result, arg1, arg2):
+        prefix = Quad.PREFIXES[arg1.type_class]
+        dst = result.name
+        temp_dst = f'_{dst}'
+        return [
+            Instruction(prefix + 'GRT', temp_dst, arg1.name, arg2.name),
+            Instruction(prefix + 'EQL', dst, arg1.name, arg2.name),
+            Instruction(prefix + 'ADD', dst, dst, temp_dst)]
+
+    @_mappers.register(Jump)
+    @staticmethod
+    def _map_jump(opcode, _, label):
+        return [Instruction('JUMP', Label(label))]
+
+    @_mappers.register(CondBr)
+    @staticmethod
+    def _map_conditional_branch(opcode, _, test_result, true_label, false_label):
+        return [Instruction('JMPZ', Label(false_label), test_result.name),
+                Instruction('JUMP', Label(true_label))]
+
+    @_mappers.register(Halt)
+    @staticmethod
+    def _map_halt(opcode):
+        return [Instruction('HALT')]
@@ -0,0 +1,103 @@
+import io
+import os
+import sys
+import unittest
+import zlib
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astfile import ASTFile
+from parser import Parser
+
+
+def save_source(source):
+    input_file = io.StringIO(source)
+    input_file.name = '<test>'
+    parser = Parser(input_file)
+    stmts = parser.parse()
+    output = io.BytesIO()
+    ASTFile.save(output, stmts, parser.variables)
+    return output.getvalue()
+
+
+def replace_args(data, args):
+    # Returns data with its column of int arguments replaced, which must keep its length
+    header_size = len(ASTFile.MAGIC) + 2
+    body = zlib.decompress(data[header_size:])
+    strings_size, _, num_variables, num_tags, num_args, _ = ASTFile.COUNTS.unpack_from(body)
+    offset = ASTFile.COUNTS.size + strings_size + num_variables + num_tags
+    column = array('q', args)
+    assert len(column) == num_args and sys.byteorder == 'little'
+    body = body[:offset] + column.tobytes() + body[offset + len(column.tobytes()):]
+    return data[:header_size] + zlib.compress(body)
+
+
+class ASTFileTest(unittest.TestCase):
+
+    SOURCE = 'a: int; { input(a); output(a + a); }'
+
+    # Input of variable 0, Use of variable 0, Add of node 2 and node 2, Output of
+    # node 3, and a list of nodes 1 and 4
+    ARGS = [0, 0, 2, 2, 3, 2, 1, 4]
+
+    SWITCH_SOURCE = 'a: int; { output(2.5); switch (a) { case 1: break; } }'
+
+    # Output of node 1 (2.5), Use of variable 0, int 1, a list of node 5 (break),
+    # Switch on node 3 with one case of node 4 and node 6, and a list of nodes 2 and 7
+    SWITCH_ARGS = [1, 0, 1, 1, 5, 3, 1, 4, 6, 2, 2, 7]
+
+    def load(self, args, source=SOURCE):
+        return ASTFile.load(io.BytesIO(replace_args(save_source(source), args)))
+
+    def assertCorrupt(self, args, source=SOURCE):
+        with self.assertRaises(ASTFile.Error):
+            self.load(args, source)
+
+    def test_valid_indices(self):
+        stmts, variables = self.load(self.ARGS)
+        self.assertEqual(list(variables), ['a'])
+        self.assertEqual(len(stmts), 2)
+
+    def test_bad_node_indices(self):
+        # Index 0 is a missing node, later nodes aren't loaded yet
+        for index in [0, -1, 3, 1 << 40]:
+            with self.subTest(index=index):
+                self.assertCorrupt([0, 0, index, 2, 3, 2, 1, 4])
+        for index in [0, -1, 5, 1 << 40]:
+            with self.subTest(index=index):
+                self.assertCorrupt([0, 0, 2, 2, 3, 2, index, 4])
+
+    def test_bad_variable_indices(self):
+        for index in [-1, 1]:
+            with self.subTest(index=index):
+                self.assertCorrupt([index, 0, 2, 2, 3, 2, 1, 4])
+                self.assertCorrupt([0, index, 2, 2, 3, 2, 1, 4])
+
+    def test_statement_as_expression(self):
+        # The input statement as an operand, and as the value to output
+        self.assertCorrupt([0, 0, 1, 2, 3, 2, 1, 4])
+        self.assertCorrupt([0, 0, 2, 2, 1, 2, 1, 4])
+
+    def test_valid_switch(self):
+        stmts, _ = self.load(self.SWITCH_ARGS, self.SWITCH_SOURCE)
+        self.assertEqual(len(stmts), 2)
+
+    def test_bad_case_values(self):
+        # A float case in an int switch, and a variable as a case
+        for index in [1, 3]:
+            with self.subTest(index=index):
+                self.assertCorrupt([1, 0, 1, 1, 5, 3, 1, index, 6, 2, 2, 7], self.SWITCH_SOURCE)
+
+    def test_break_outside_switch(self):
+        self.assertCorrupt([1, 0, 1, 1, 5, 3, 1, 4, 6, 2, 2, 5], self.SWITCH_SOURCE)
+        self.assertCorrupt([1, 0, 1, 1, 5, 3, 1, 4, 6, 2, 2, 6], self.SWITCH_SOURCE)
+
+    def test_truncated(self):
+        data = save_source(self.SOURCE)
+        with self.assertRaises(ASTFile.Error):
+            ASTFile.load(io.BytesIO(data[:-4]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexer import Lexer, RegexLexer
+from tokens import Token
+
+
+class TokenStreamTest(unittest.TestCase):
+
+    SOURCE = 'a: int; /* a comment */\n{ a = 1; /* another one */ output(a); }'
+
+    def test_comments_have_no_data(self):
+        for lexer_class in [Lexer, RegexLexer]:
+            with self.subTest(lexer_class=lexer_class.__name__):
+                input_file = io.StringIO(self.SOURCE)
+                input_file.name = '<test>'
+                stream = lexer_class(input_file).tokens()
+                self.assertEqual(stream.data, ['a', 1])
+                comments = [i for i in range(len(stream)) if stream.kinds[i] == Token.COMMENT]
+                self.assertEqual(len(comments), 2)
+                self.assertEqual([stream.data_of(i) for i in comments], [None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ir import *
+from optimizer import evaluate
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def test_division_by_zero(self):
+        self.assertIsNone(evaluate(Div(Immediate(1), Immediate(0)), [1, 0]))
+
+    def test_int_too_large_for_float(self):
+        big = 10 ** 400
+        self.assertIsNone(evaluate(StaticCast(Immediate(big), Float), [big]))
+
+    def test_non_finite_float_to_int(self):
+        for value in [math.inf, math.nan]:
+            self.assertIsNone(evaluate(StaticCast(Immediate(1.0), Integer), [value]))
+
+    def test_finite_values(self):
+        self.assertEqual(evaluate(Add(Immediate(2.0), Immediate(0.5)), [2.0, 0.5]), 2.5)
+        self.assertEqual(evaluate(StaticCast(Immediate(-2.5), Integer), [-2.5]), -2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cpl
+
+
+def compile_source(source):
+    input_file = io.StringIO(source)
+    input_file.name = '<test>'
+    output = io.StringIO()
+    cpl.compile_stream(input_file, output)
+    return output.getvalue().splitlines()
+
+
+class CommonSubexpressionTest(unittest.TestCase):
+
+    def test_variable_written_before_reused_result(self):
+        # a + b is held by x, which is assigned 5 before the product reads it
+        code = compile_source('x, a, b: int; { input(a); input(b); x = a + b; output(x); '
+                              'output((a + b) * (x = 5)); }')
+        self.assertEqual(code, [
+            'IINP a',
+            'IINP b',
+            'IADD x a b',
+            'IPRT x',
+            'IASN t1 x',
+            'IASN x 5',
+            'IMLT t1 t1 x',
+            'IPRT t1',
+            'HALT',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
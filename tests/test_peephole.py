@@ -0,0 +1,132 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codegen import Instruction
+from peephole import Peephole
+from quad import Quad
+
+
+def parse_instruction(line):
+    opcode, *words = line.split()
+    operands = []
+    for word in words:
+        for number_type in [int, float]:
+            try:
+                word = number_type(word)
+                break
+            except ValueError:
+                pass
+        operands.append(word)
+    return Instruction(opcode, *operands)
+
+
+class QuadPeepholeTest(unittest.TestCase):
+
+    def optimize(self, lines, live_out=()):
+        # Returns the rewritten lines, and the names of the rules that were applied
+        peephole = Peephole(Quad.PEEPHOLE_RULES, Quad.READING_OPCODES)
+        instructions = peephole.optimize([parse_instruction(line) for line in lines], set(live_out))
+        return [str(instr) for instr in instructions], {name for name, hits in peephole.hits.items() if hits > 0}
+
+    def assertRewritten(self, lines, expected, rule, live_out=()):
+        code, applied = self.optimize(lines, live_out)
+        self.assertEqual(code, expected)
+        self.assertIn(rule, applied)
+
+    def assertUnchanged(self, lines, live_out=()):
+        code, applied = self.optimize(lines, live_out)
+        self.assertEqual(code, lines)
+        self.assertEqual(applied, set())
+
+    def test_int_le_constant(self):
+        self.assertRewritten(['ILSS _t1 a 3', 'IEQL t1 a 3', 'IADD t1 t1 _t1'],
+                             ['ILSS t1 a 4'],
+                             'le-int-constant', live_out=['t1'])
+
+    def test_int_ge_constant(self):
+        self.assertRewritten(['IGRT _t1 a 3', 'IEQL t1 a 3', 'IADD t1 t1 _t1'],
+                             ['IGRT t1 a 2'],
+                             'ge-int-constant', live_out=['t1'])
+
+    def test_le_variable(self):
+        self.assertUnchanged(['ILSS _t1 a b', 'IEQL t1 a b', 'IADD t1 t1 _t1'], live_out=['t1'])
+
+    def test_float_le_constant(self):
+        # There is no next float to compare with
+        self.assertUnchanged(['RLSS _t1 a 3.0', 'REQL t1 a 3.0', 'RADD t1 t1 _t1'], live_out=['t1'])
+
+    def test_float_ge_constant(self):
+        self.assertUnchanged(['RGRT _t1 a 3.0', 'REQL t1 a 3.0', 'RADD t1 t1 _t1'], live_out=['t1'])
+
+    def test_le_constant_with_live_temp(self):
+        self.assertUnchanged(['ILSS _t1 a 3', 'IEQL t1 a 3', 'IADD t1 t1 _t1', 'IPRT _t1'], live_out=['t1'])
+
+    def test_int_le_branch(self):
+        self.assertRewritten(['ILSS _t1 a b', 'IEQL t1 a b', 'IADD t1 t1 _t1', 'JMPZ else t1', 'JUMP then'],
+                             ['IGRT t1 a b', 'JMPZ then t1', 'JUMP else'],
+                             'le-branch')
+
+    def test_int_ge_branch(self):
+        self.assertRewritten(['IGRT _t1 a b', 'IEQL t1 a b', 'IADD t1 t1 _t1', 'JMPZ else t1', 'JUMP then'],
+                             ['ILSS t1 a b', 'JMPZ then t1', 'JUMP else'],
+                             'ge-branch')
+
+    def test_float_le_branch(self):
+        # a <= b and a > b are both false when a is NaN
+        self.assertUnchanged(['RLSS _t1 a b', 'REQL t1 a b', 'RADD t1 t1 _t1', 'JMPZ else t1', 'JUMP then'])
+
+    def test_float_ge_branch(self):
+        self.assertUnchanged(['RGRT _t1 a b', 'REQL t1 a b', 'RADD t1 t1 _t1', 'JMPZ else t1', 'JUMP then'])
+
+    def test_branch_on_live_comparison(self):
+        self.assertUnchanged(['ILSS _t1 a b', 'IEQL t1 a b', 'IADD t1 t1 _t1', 'JMPZ else t1', 'JUMP then'],
+                             live_out=['t1'])
+
+    def test_normalized_comparison(self):
+        # Comparisons of floats have int results as well
+        for prefix in ['I', 'R']:
+            for name in ['EQL', 'NQL', 'LSS', 'GRT']:
+                self.assertRewritten([f'{prefix}{name} t1 a b', 'INQL t1 t1 0'],
+                                     [f'{prefix}{name} t1 a b'],
+                                     f'{name.lower()}-normalized')
+                self.assertRewritten([f'{prefix}{name} t1 a b', 'INQL t2 t1 0'],
+                                     [f'{prefix}{name} t2 a b'],
+                                     f'{name.lower()}-normalized', live_out=['t2'])
+
+    def test_normalized_comparison_with_live_result(self):
+        self.assertUnchanged(['RLSS t1 a b', 'INQL t2 t1 0'], live_out=['t1', 't2'])
+
+    def test_normalized_value(self):
+        self.assertUnchanged(['IADD t1 a b', 'INQL t1 t1 0'], live_out=['t1'])
+
+    def test_int_add_zero(self):
+        self.assertRewritten(['IADD t1 0 a'], ['IASN t1 a'], 'add-zero')
+
+    def test_float_add_zero(self):
+        # 0.0 + -0.0 is 0.0
+        self.assertUnchanged(['RADD t1 0 a'])
+
+    def test_self_assign(self):
+        for prefix in ['I', 'R']:
+            self.assertRewritten([f'{prefix}ASN a a', f'{prefix}PRT a'], [f'{prefix}PRT a'], 'self-assign')
+        self.assertUnchanged(['IASN a b'])
+
+    def test_branch_on_zero(self):
+        self.assertRewritten(['JMPZ else 0', 'JUMP then'], ['JUMP else'], 'jmpz-zero')
+
+    def test_branch_on_nonzero(self):
+        for value in ['1', '-2', '0.5']:
+            self.assertRewritten([f'JMPZ else {value}', 'JUMP then'], ['JUMP then'], 'jmpz-nonzero')
+
+    def test_branch_on_variable(self):
+        self.assertUnchanged(['JMPZ else a', 'JUMP then'])
+
+    def test_unreachable_jump(self):
+        self.assertRewritten(['JUMP a', 'JUMP b'], ['JUMP a'], 'unreachable-jump')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,8 @@
+from array import array
+import bisect
+import re
+
+
 class SourceLocation:
     def __init__(self, file_path, line, column):
         self.file_path = file_path
@@ -8,6 +13,23 @@ class SourceLocation:
         return f'{self.file_path}:{self.line}:{self.column}'
 
 
+class SourceFile:
+    def __init__(self, path, text):
+        self.path = path
+        self.text = text
+        self._line_starts = None
+
+    def location(self, offset):
+        # Line starts are only computed once a location is actually needed
+        if self._line_starts is None:
+            self._line_starts = array('L', [0])
+            self._line_starts.extend(m.end() for m in re.finditer('\n', self.text))
+
+        line = bisect.bisect_right(self._line_starts, offset)
+        column = offset - self._line_starts[line - 1] + 1
+        return SourceLocation(self.path, line, column)
+
+
 class Token:
     # Keywords
     BREAK = 1
@@ -74,3 +96,78 @@ class Token:
 ALL_ATTRS = {attr: getattr(Token, attr) for attr in dir(Token)}
 Token.KIND_TO_STR = {value: attr for attr, value in ALL_ATTRS.items()
                      if isinstance(value, int) and not attr.startswith('__')}
+
+
+class TokenStream:
+    """
+    Compact struct-of-arrays storage of lexed tokens.
+
+    Token kinds, source offsets and file ids are kept in parallel arrays and
+    token data (identifiers and numbers) is interned in a shared table. The
+    text of comments is dropped, since the parser skips them.
+    Token and SourceLocation objects are only created on demand.
+    """
+
+    NO_DATA = -1
+
+    def __init__(self):
+        self.files = []
+        self.kinds = array('B')
+        self.offsets = array('L')
+        self.file_ids = array('H')
+        self.data_ids = array('l')
+        self.data = []
+        self._data_to_id = {}
+
+    def add_file(self, source_file):
+        self.files.append(source_file)
+        return len(self.files) - 1
+
+    def append(self, file_id, kind, offset, data=None):
+        self.extend(file_id, [(kind, offset, data)])
+
+    def extend(self, file_id, tokens):
+        # Bind the hot methods once, this runs for every token in the source
+        append_kind = self.kinds.append
+        append_offset = self.offsets.append
+        append_file_id = self.file_ids.append
+        append_data_id = self.data_ids.append
+        data_to_id = self._data_to_id
+
+        for kind, offset, data in tokens:
+            if data is None or kind == Token.COMMENT:
+                data_id = self.NO_DATA
+            else:
+                # Key on the type as well so that 1 and 1.0 are kept apart
+                key = (type(data), data)
+                data_id = data_to_id.get(key)
+                if data_id is None:
+                    data_id = len(self.data)
+                    self.data.append(data)
+                    data_to_id[key] = data_id
+
+            append_kind(kind)
+            append_offset(offset)
+            append_file_id(file_id)
+            append_data_id(data_id)
+
+    def data_of(self, index):
+        data_id = self.data_ids[index]
+        return None if data_id == self.NO_DATA else self.data[data_id]
+
+    def location(self, index):
+        # Past the last token, point at the end of the last file
+        if index >= len(self.kinds):
+            source_file = self.files[-1]
+            return source_file.location(len(source_file.text))
+        return self.files[self.file_ids[index]].location(self.offsets[index])
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        return Token(self.kinds[index], self.location(index), self.data_of(index))
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
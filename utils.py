@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import gc
 import sys
 import contextlib
 
@@ -9,12 +10,77 @@ def smart_open(file_path, mode):
     if file_path != '-':
         f = open(file_path, mode)
     elif 'r' in mode:
-        f = sys.stdin
+        f = sys.stdin.buffer if 'b' in mode else sys.stdin
     else:
-        f = sys.stdout
+        f = sys.stdout.buffer if 'b' in mode else sys.stdout
 
     try:
         yield f
     finally:
-        if f not in [sys.stdin, sys.stdout]:
+        if file_path != '-':
             f.close()
+
+
+@contextlib.contextmanager
+def gc_paused():
+    # For blocks that allocate many long-lived objects and little garbage,
+    # where garbage collections would only keep rescanning the new objects
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def trampoline(gen):
+    """
+    Runs a recursive computation written as generators without growing the
+    Python stack. A generator "calls" another by yielding it, and receives the
+    callee's return value as the result of the yield expression.
+    """
+    stack = [gen]
+    value = None
+    while True:
+        try:
+            callee = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value
+            value = stop.value
+        else:
+            stack.append(callee)
+            value = None
+
+
+class TypeDispatch:
+    """
+    Maps classes to handlers, such as the method that emits each kind of node.
+    A class without a handler of its own gets the one of its nearest base class
+    in the MRO, which is resolved on its first lookup and cached.
+    """
+
+    __slots__ = ('_handlers', '_cache')
+
+    def __init__(self):
+        self._handlers = {}
+        self._cache = {}
+
+    def register(self, *classes):
+        # A decorator, the handler is returned unchanged
+        def decorator(handler):
+            for cls in classes:
+                self._handlers[cls] = handler
+            self._cache.clear()
+            return handler
+        return decorator
+
+    def lookup(self, cls):
+        # Returns None if neither cls nor any of its bases has a handler
+        handler = self._cache.get(cls)
+        if handler is None:
+            handler = self._cache[cls] = next(
+                (self._handlers[base] for base in cls.__mro__ if base in self._handlers), None)
+        return handler